@@ -1,70 +1,212 @@
+import os from 'os';
 import path from 'path';
 
 const __dirname = import.meta.dir;
 
-async function executeSticker(request) {
-    const pythonScript = path.join(__dirname, '../python/sticker.py');
-    
-    const proc = Bun.spawn(['python3', pythonScript], {
-        stdin: 'pipe',
-        stdout: 'pipe',
-        stderr: 'pipe',
-    });
-
-    const requestJson = JSON.stringify(request);
-    proc.stdin.write(requestJson);
-    proc.stdin.flush();
-    proc.stdin.end();
+const pythonScript = path.join(__dirname, '../python/sticker.py');
+// Each worker converts one request at a time, so keep a few for concurrent stickers
+const DEFAULT_POOL_SIZE = Math.min(4, Math.max(2, os.cpus().length));
+const POOL_SIZE = Math.max(1, parseInt(Bun.env.STICKER_WORKERS || '', 10) || DEFAULT_POOL_SIZE);
+const REQUEST_TIMEOUT = 120000;
 
-    const stdoutPromise = new Response(proc.stdout).text();
-    const stderrPromise = new Response(proc.stderr).text();
+/**
+ * One warm `sticker.py --serve` process.
+ * Requests and responses are length-prefixed JSON headers (4-byte big endian length)
+ * followed by raw media bytes (`inputSize` / `size`), matched through `id`.
+ * The process answers requests in order, one at a time, so the oldest pending
+ * entry is the one running: only its timeout is armed.
+ */
+class StickerWorker {
+    constructor() {
+        this.proc = null;
+        this.pending = new Map();
+        this.nextId = 1;
+        this.buffer = Buffer.alloc(0);
+        this.header = null;
+    }
 
-    const exitCode = await proc.exited;
-    const stdoutData = await stdoutPromise;
-    const stderrData = await stderrPromise;
+    start() {
+        const proc = Bun.spawn(['python3', pythonScript, '--serve'], {
+            stdin: 'pipe',
+            stdout: 'pipe',
+            stderr: 'inherit',
+        });
+        this.proc = proc;
+        this.buffer = Buffer.alloc(0);
+        this.header = null;
+        this.readLoop(proc);
+        proc.exited.then((code) => {
+            // A process recycled after a timeout already handed its queue to the next one
+            if (this.proc !== proc) return;
+            this.proc = null;
+            this.failAll(new Error(`Python process exited with code ${code}`));
+        });
+    }
 
-    if (exitCode !== 0) {
-        throw new Error(`Python process exited with code ${exitCode}: ${stderrData}`);
+    async readLoop(proc) {
+        const reader = proc.stdout.getReader();
+        try {
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                this.buffer = Buffer.concat([this.buffer, Buffer.from(value)]);
+                this.drain();
+            }
+        } catch {}
     }
 
-    try {
-        const response = JSON.parse(stdoutData);
-        
-        if (response.success) {
-            return Buffer.from(response.data, 'base64');
-        } else {
-            throw new Error(response.error || 'Unknown error');
+    drain() {
+        while (true) {
+            if (!this.header) {
+                if (this.buffer.length < 4) return;
+                const length = this.buffer.readUInt32BE(0);
+                if (this.buffer.length < 4 + length) return;
+
+                const payload = this.buffer.subarray(4, 4 + length).toString('utf8');
+                this.buffer = this.buffer.subarray(4 + length);
+
+                try {
+                    this.header = JSON.parse(payload);
+                } catch (error) {
+                    this.failAll(new Error(`Failed to parse Python output: ${error.message}`));
+                    this.proc?.kill();
+                    return;
+                }
+            }
+
+            const size = this.header.size || 0;
+            if (this.buffer.length < size) return;
+
+            const response = this.header;
+            const data = Buffer.from(this.buffer.subarray(0, size));
+            this.buffer = this.buffer.subarray(size);
+            this.header = null;
+
+            const entry = this.pending.get(response.id);
+            if (!entry) continue;
+
+            // createBatch: one frame per finished item, then a `done` frame
+            if (response.index !== undefined && !response.done) {
+                clearTimeout(entry.timer);
+                entry.timer = entry.arm();
+                entry.onItem?.(response, data);
+                continue;
+            }
+            this.pending.delete(response.id);
+            clearTimeout(entry.timer);
+            this.armHead();
+
+            if (response.success) {
+                entry.resolve(data);
+            } else {
+                entry.reject(new Error(response.error || 'Unknown error'));
+            }
         }
-    } catch (error) {
-        if (error.message.includes('JSON')) {
-             throw new Error(`Failed to parse Python output: ${error.message}\nRaw Output: ${stdoutData}`);
+    }
+
+    /** Start the timeout of the request Python is working on now */
+    armHead() {
+        const head = this.pending.values().next().value;
+        if (head && !head.timer) head.timer = head.arm();
+    }
+
+    /**
+     * Kill a stuck process and resend the requests queued behind the timed-out
+     * one to a fresh process; Python had not started on them yet.
+     */
+    recycle() {
+        const queued = [...this.pending.values()];
+        const proc = this.proc;
+        this.proc = null;
+        proc?.kill();
+
+        this.start();
+        for (const entry of queued) this.write(entry.chunks);
+        this.armHead();
+    }
+
+    write(chunks) {
+        for (const chunk of chunks) this.proc.stdin.write(chunk);
+        this.proc.stdin.flush();
+    }
+
+    failAll(error) {
+        for (const entry of this.pending.values()) {
+            clearTimeout(entry.timer);
+            entry.reject(error);
         }
-        throw error;
+        this.pending.clear();
+    }
+
+    request(request, input, onItem) {
+        if (!this.proc) this.start();
+
+        const id = this.nextId++;
+        // Without a buffer the media is referenced by `inputPath` and only the result comes back raw
+        const frame = input ? { ...request, id, inputSize: input.length } : { ...request, id, binary: true };
+        const payload = Buffer.from(JSON.stringify(frame));
+        const header = Buffer.alloc(4);
+        header.writeUInt32BE(payload.length, 0);
+
+        const chunks = input ? [header, payload, input] : [header, payload];
+
+        return new Promise((resolve, reject) => {
+            // Armed once Python reaches this request; batches re-arm it on every finished item
+            const arm = () => setTimeout(() => {
+                this.pending.delete(id);
+                reject(new Error(`Sticker request timed out after ${REQUEST_TIMEOUT}ms`));
+                // A stuck conversion blocks the whole worker, so recycle it
+                this.recycle();
+            }, REQUEST_TIMEOUT);
+
+            this.pending.set(id, { resolve, reject, timer: null, arm, onItem, chunks });
+            this.write(chunks);
+            this.armHead();
+        });
     }
 }
 
+const workers = Array.from({ length: POOL_SIZE }, () => new StickerWorker());
+
+async function executeSticker(request, input, onItem) {
+    // Least busy worker wins
+    const worker = workers.reduce((a, b) => (b.pending.size < a.pending.size ? b : a));
+    return worker.request(request, input, onItem);
+}
+
+/**
+ * @param {Buffer|string} media Buffer, or a path to a file on disk (large videos
+ *   are then read by FFmpeg directly instead of being copied through the pipe)
+ */
 export async function sticker(media, options = {}) {
-    if (!Buffer.isBuffer(media)) {
-        throw new Error('Input must be a Buffer');
+    const isPath = typeof media === 'string';
+    if (!isPath && !Buffer.isBuffer(media)) {
+        throw new Error('Input must be a Buffer or a file path');
     }
 
     const {
         crop = false,
         quality = 80,
-        fps = 15,
+        fps,
         maxDuration = 15,
         packName = '',
         authorName = '',
-        emojis = []
+        emojis = [],
+        workers = 1,
+        preset,
+        targetBytes,
+        startTime,
+        endTime,
+        stablePackId,
+        encoding
     } = options;
-    
-    if (isWebP(media)) {
-        return addExif(media, options);
-    }
+
+    // WebP goes through `create` too: a ready 512x512 sticker only gets its metadata
+    // rewritten there, an oversized one is resized frame by frame
 
     const request = {
         command: 'create',
-        input: media.toString('base64'),
+        ...(isPath ? { inputPath: path.resolve(media) } : {}),
         options: {
             crop,
             quality,
@@ -72,14 +214,68 @@ export async function sticker(media, options = {}) {
             maxDuration,
             packName,
             authorName,
+            emojis: Array.isArray(emojis) ? emojis : [],
+            workers,
+            preset,
+            targetBytes,
+            startTime,
+            endTime,
+            stablePackId,
+            encoding
+        }
+    };
+
+    return await executeSticker(request, isPath ? null : media);
+}
+
+/**
+ * Convert many inputs with shared pack metadata in one request.
+ * Items run concurrently inside one worker; `onItem` fires as each one finishes.
+ * A bad input only fails its own entry.
+ * @param {(Buffer|string)[]} medias Buffers or file paths
+ * @param {object} options Same options as `sticker`, plus `concurrency`
+ * @param {(item: {index: number, sticker?: Buffer, error?: string}) => void} [onItem]
+ * @returns {Promise<{index: number, sticker?: Buffer, error?: string}[]>} in input order
+ */
+export async function stickerBatch(medias, options = {}, onItem) {
+    const { concurrency, emojis = [], ...shared } = options;
+    const items = [];
+    const buffers = [];
+
+    for (const media of medias) {
+        if (typeof media === 'string') {
+            items.push({ inputPath: path.resolve(media) });
+        } else if (Buffer.isBuffer(media)) {
+            items.push({ inputSize: media.length });
+            buffers.push(media);
+        } else {
+            throw new Error('Input must be a Buffer or a file path');
+        }
+    }
+
+    const results = new Array(items.length);
+    const request = {
+        command: 'createBatch',
+        concurrency,
+        items,
+        options: {
+            ...shared,
             emojis: Array.isArray(emojis) ? emojis : []
         }
     };
 
-    return await executeSticker(request);
+    await executeSticker(request, buffers.length ? Buffer.concat(buffers) : null, (response, data) => {
+        const item = response.success
+            ? { index: response.index, sticker: data }
+            : { index: response.index, error: response.error || 'Unknown error' };
+        results[response.index] = item;
+        onItem?.(item);
+    });
+
+    return results;
 }
 
-async function addExif(webp, metadata = {}) {
+export async function addExif(webp, metadata = {}) {
     if (!Buffer.isBuffer(webp)) {
         throw new Error('Input must be a Buffer');
     }
@@ -87,27 +283,59 @@ async function addExif(webp, metadata = {}) {
     const {
         packName = '',
         authorName = '',
-        emojis = []
+        emojis = [],
+        stablePackId
     } = metadata;
 
     const request = {
         command: 'addExif',
-        input: webp.toString('base64'),
         metadata: {
             packName,
             authorName,
-            emojis: Array.isArray(emojis) ? emojis : []
+            emojis: Array.isArray(emojis) ? emojis : [],
+            stablePackId
         }
     };
 
-    return await executeSticker(request);
+    return await executeSticker(request, webp);
 }
 
-function isWebP(buffer) {
-    return (
-        Buffer.isBuffer(buffer) &&
-        buffer.length >= 12 &&
-        buffer.slice(0, 4).toString() === 'RIFF' &&
-        buffer.slice(8, 12).toString() === 'WEBP'
-    );
+/**
+ * One frame of a WebP sticker as PNG or JPEG.
+ * @param {Buffer} webp
+ * @param {{format?: 'png'|'jpeg', frame?: number, quality?: number, background?: number[]}} options
+ */
+export async function toImage(webp, options = {}) {
+    if (!Buffer.isBuffer(webp)) {
+        throw new Error('Input must be a Buffer');
+    }
+
+    const { format = 'png', frame = 0, quality = 90, background } = options;
+    const request = {
+        command: 'toImage',
+        options: { format, frame, quality, ...(background ? { background } : {}) }
+    };
+
+    return await executeSticker(request, webp);
+}
+
+/**
+ * Animated WebP sticker as an H.264 MP4, streamed through FFmpeg's pipes without
+ * temporary files. The MP4 is fragmented (moov up front, moof/mdat per keyframe)
+ * because a pipe cannot be seeked back to write a regular moov box.
+ * @param {Buffer} webp
+ * @param {{fps?: number, crf?: number, maxDuration?: number, background?: number[]}} options
+ */
+export async function toVideo(webp, options = {}) {
+    if (!Buffer.isBuffer(webp)) {
+        throw new Error('Input must be a Buffer');
+    }
+
+    const { fps = 30, crf = 23, maxDuration = 15, background } = options;
+    const request = {
+        command: 'toVideo',
+        options: { fps, crf, maxDuration, ...(background ? { background } : {}) }
+    };
+
+    return await executeSticker(request, webp);
 }
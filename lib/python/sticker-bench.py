@@ -0,0 +1,967 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for sticker.py
+
+Usage:
+    python3 sticker-bench.py serve [--requests N]
+    python3 sticker-bench.py transport [--input FILE] [--size-mb N]
+    python3 sticker-bench.py stream-memory [--frames N]
+    python3 sticker-bench.py resample [--source-fps N] [--seconds N]
+    python3 sticker-bench.py parallel [--frames N] [--max-workers N] [--pool thread|process]
+    python3 sticker-bench.py presets [--repeat N]
+    python3 sticker-bench.py exif [--iterations N]
+    python3 sticker-bench.py seek [--seconds N] [--start N] [--size WxH] [--rate N]
+    python3 sticker-bench.py profile [--frames N] [--repeat N]
+    python3 sticker-bench.py photos [--repeat N]
+    python3 sticker-bench.py suite [--repeat N] [--only NAME ...] [--output FILE] [--baseline FILE]
+    python3 sticker-bench.py reverse [--frames N] [--repeat N]
+    python3 sticker-bench.py palette [--frames N] [--repeat N]
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import List, Tuple
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STICKER_SCRIPT = os.path.join(HERE, 'sticker.py')
+
+sys.path.insert(0, HERE)
+from sticker import FRAME_HEADER, StickerConverter, handle_request, read_frame, write_frame  # noqa: E402
+
+
+# Runs a script like `python3 script args...` and reports its own peak RSS on
+# stderr at exit. ru_maxrss from wait4() is not usable here: Linux carries the
+# high-water mark across fork+exec, so a child would inherit this process's peak.
+RSS_WRAPPER = """
+import atexit, runpy, sys
+def report():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                sys.stderr.write('VmHWM ' + line.split()[1] + '\\n')
+atexit.register(report)
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+
+def peak_rss_kb() -> int:
+    """Peak RSS of the current process image in KB (VmHWM, reset on exec)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def make_png(width: int = 640, height: int = 480) -> bytes:
+    """Deterministic gradient PNG used as a small, typical input"""
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    output = io.BytesIO()
+    img.save(output, format='PNG')
+    return output.getvalue()
+
+
+def make_photo(width: int, height: int, fmt: str = 'JPEG') -> bytes:
+    """Deterministic photo-like image: fractal detail, gradient and sensor-ish noise"""
+    detail = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 0.8, 1.2), 60)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 24)
+    img = Image.merge('RGB', (detail, gradient, noise))
+    output = io.BytesIO()
+    img.save(output, format=fmt, quality=90)
+    return output.getvalue()
+
+
+def make_gif(frames: int, size: int = 480, duration: int = 66) -> bytes:
+    """Deterministic animated GIF: a ball moving over a flat background"""
+    images = []
+    for i in range(frames):
+        img = Image.new('RGB', (size, size), (40, 80, 160))
+        x = (i * 7) % (size - 80)
+        ImageDraw.Draw(img).ellipse((x, x // 2, x + 80, x // 2 + 80), fill=(255, 220, 0))
+        images.append(img)
+    output = io.BytesIO()
+    images[0].save(output, format='GIF', save_all=True, append_images=images[1:], duration=duration, loop=0)
+    return output.getvalue()
+
+
+def make_mp4(size_mb: int) -> bytes:
+    """Synthetic high-bitrate MP4 from FFmpeg testsrc2, roughly `size_mb` megabytes"""
+    seconds = 10
+    bitrate = size_mb * 8 * 1024 // seconds
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={seconds}',
+        '-c:v', 'libx264', '-b:v', f'{bitrate}k', '-pix_fmt', 'yuv420p',
+        '-movflags', 'frag_keyframe+empty_moov',
+        '-f', 'mp4', 'pipe:1'
+    ]
+    return subprocess.run(cmd, capture_output=True, check=True).stdout
+
+
+def make_clip(path: str, seconds: int, size: str = '1920x1080', rate: int = 60) -> None:
+    """Long high-res FFmpeg testsrc2 clip written to `path` (seekable MP4)"""
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}:duration={seconds}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(rate * 2), '-pix_fmt', 'yuv420p',
+        path
+    ]
+    subprocess.run(cmd, capture_output=True, check=True)
+
+
+def make_video(fmt: str, seconds: int = 5, size: str = '1280x720', rate: int = 30) -> bytes:
+    """Synthetic FFmpeg testsrc2 clip as 'mp4' (H.264) or 'webm' (VP9), fixed encoder settings"""
+    if fmt == 'webm':
+        codec = ['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', '-b:v', '1M', '-f', 'webm']
+    else:
+        codec = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p',
+                 '-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4']
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}:duration={seconds}',
+        '-threads', '1', *codec, 'pipe:1'
+    ]
+    return subprocess.run(cmd, capture_output=True, check=True).stdout
+
+
+def run_measured(args, payload: bytes):
+    """Run `python3 *args` with `payload` on stdin; returns (stdout, wall seconds, peak RSS in KB)"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-c', RSS_WRAPPER, *args],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+
+    def feed():
+        proc.stdin.write(payload)
+        proc.stdin.close()
+
+    writer = threading.Thread(target=feed)
+    writer.start()
+    output = proc.stdout.read()
+    writer.join()
+    errors = proc.stderr.read().decode('utf-8', errors='ignore')
+    proc.wait()
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{args} exited with {proc.returncode}: {errors}")
+    peak = [int(line.split()[1]) for line in errors.splitlines() if line.startswith('VmHWM ')]
+    return output, wall, peak[-1] if peak else None
+
+
+def _child_create(conn, media: bytes, kwargs: dict):
+    base_rss = peak_rss_kb()
+    start = time.perf_counter()
+    result = StickerConverter().create_sticker(media, **kwargs)
+    wall = time.perf_counter() - start
+    peak_rss = peak_rss_kb()
+    conn.send({'wall_s': round(wall, 3), 'rss_delta_kb': peak_rss - base_rss, 'output_bytes': len(result)})
+    conn.close()
+
+
+def create_in_child(media: bytes, **kwargs) -> dict:
+    """Run create_sticker in a fresh process so peak RSS is not polluted by earlier runs"""
+    ctx = multiprocessing.get_context('spawn')
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child_create, args=(child, media, kwargs))
+    proc.start()
+    result = parent.recv()
+    proc.join()
+    return result
+
+
+def create_request(media: bytes, request_id=None) -> dict:
+    request = {
+        'command': 'create',
+        'input': base64.b64encode(media).decode('utf-8'),
+        'options': {'packName': 'bench', 'authorName': 'bench'},
+    }
+    if request_id is not None:
+        request['id'] = request_id
+    return request
+
+
+def bench_oneshot(media: bytes, count: int) -> float:
+    """Spawn `python3 sticker.py` once per request, like the old JS client"""
+    payload = json.dumps(create_request(media)).encode('utf-8')
+    start = time.perf_counter()
+    for _ in range(count):
+        proc = subprocess.run(
+            [sys.executable, STICKER_SCRIPT],
+            input=payload,
+            capture_output=True,
+            check=True
+        )
+        if not json.loads(proc.stdout)['success']:
+            raise RuntimeError(proc.stdout)
+    return count / (time.perf_counter() - start)
+
+
+def bench_serve(media: bytes, count: int) -> float:
+    """Push every request through one warm `sticker.py --serve` process"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, STICKER_SCRIPT, '--serve'],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE
+    )
+    try:
+        for i in range(count):
+            write_frame(proc.stdin, create_request(media, i))
+            response = read_frame(proc.stdout)
+            if not response['success'] or response['id'] != i:
+                raise RuntimeError(response)
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    return count / (time.perf_counter() - start)
+
+
+def cmd_serve(args) -> dict:
+    media = make_png()
+    oneshot = bench_oneshot(media, args.requests)
+    serve = bench_serve(media, args.requests)
+    return {
+        'requests': args.requests,
+        'oneshot_rps': round(oneshot, 2),
+        'serve_rps': round(serve, 2),
+        'speedup': round(serve / oneshot, 2),
+    }
+
+
+def cmd_transport(args) -> dict:
+    if args.input:
+        with open(args.input, 'rb') as f:
+            media = f.read()
+    else:
+        media = make_mp4(args.size_mb)
+
+    options = {'packName': 'bench', 'authorName': 'bench'}
+
+    # JSON mode: base64 media inside one JSON document
+    json_payload = json.dumps(create_request(media)).encode('utf-8')
+    out, json_wall, json_rss = run_measured([STICKER_SCRIPT], json_payload)
+    json_size = len(base64.b64decode(json.loads(out)['data']))
+
+    # Binary mode: small JSON header followed by the raw bytes
+    header = json.dumps({'command': 'create', 'options': options, 'inputSize': len(media)}).encode('utf-8')
+    bin_payload = FRAME_HEADER.pack(len(header)) + header + media
+    out, bin_wall, bin_rss = run_measured([STICKER_SCRIPT, '--binary'], bin_payload)
+    (header_len,) = FRAME_HEADER.unpack_from(out)
+    response = json.loads(out[FRAME_HEADER.size:FRAME_HEADER.size + header_len])
+    if not response['success']:
+        raise RuntimeError(response['error'])
+
+    return {
+        'input_bytes': len(media),
+        'output_bytes': {'json': json_size, 'binary': response['size']},
+        'stdin_bytes': {'json': len(json_payload), 'binary': len(bin_payload)},
+        'wall_s': {'json': round(json_wall, 3), 'binary': round(bin_wall, 3)},
+        'peak_rss_kb': {'json': json_rss, 'binary': bin_rss},
+    }
+
+
+def cmd_stream_memory(args) -> dict:
+    media = make_gif(args.frames)
+    return {
+        'frames': args.frames,
+        'input_bytes': len(media),
+        'list': create_in_child(media, streaming=False, use_cache=False),
+        'streaming': create_in_child(media, streaming=True, use_cache=False),
+    }
+
+
+def describe_webp(data: bytes) -> dict:
+    img = Image.open(io.BytesIO(data))
+    total = 0
+    for i in range(getattr(img, 'n_frames', 1)):
+        img.seek(i)
+        img.load()
+        total += img.info.get('duration', 0)
+    return {'frames': getattr(img, 'n_frames', 1), 'playback_ms': total, 'bytes': len(data)}
+
+
+def cmd_resample(args) -> dict:
+    source_frames = args.source_fps * args.seconds
+    media = make_gif(source_frames, duration=1000 // args.source_fps)
+    converter = StickerConverter()
+
+    results = {}
+    # fps=source keeps every source frame, which is what first-N truncation decoded and encoded
+    for label, fps in (('target_15fps', 15), ('all_frames', args.source_fps)):
+        start = time.perf_counter()
+        output = converter.create_sticker(media, fps=fps, use_cache=False)
+        results[label] = {'wall_s': round(time.perf_counter() - start, 3), **describe_webp(output)}
+
+    return {
+        'source': {'fps': args.source_fps, 'frames': source_frames, 'playback_ms': args.seconds * 1000},
+        **results,
+    }
+
+
+def cmd_parallel(args) -> dict:
+    media = make_gif(args.frames)
+    max_workers = args.max_workers or os.cpu_count() or 1
+    counts = sorted({1, max_workers} | {n for n in (2, 4, 8, 16, 32) if n < max_workers})
+
+    # Decoded source frames, to time the resize stage on its own
+    img = Image.open(io.BytesIO(media))
+    frames = []
+    for i in range(img.n_frames):
+        img.seek(i)
+        frames.append(img.convert('RGBA'))
+
+    runs = []
+    for workers in counts:
+        converter = StickerConverter()
+        pool = converter._frame_pool(workers, args.pool) if workers > 1 else None
+
+        start = time.perf_counter()
+        if pool is None:
+            for frame in frames:
+                StickerConverter._resize_image(frame)
+        else:
+            list(pool.map(StickerConverter._resize_image, frames))
+        resize_wall = time.perf_counter() - start
+
+        start = time.perf_counter()
+        converter.create_sticker(media, use_cache=False, workers=workers, pool=args.pool)
+        total_wall = time.perf_counter() - start
+        runs.append({'workers': workers, 'resize_s': resize_wall, 'create_s': total_wall})
+
+    base = runs[0]
+    for run in runs:
+        run['resize_speedup'] = round(base['resize_s'] / run['resize_s'], 2)
+        run['create_speedup'] = round(base['create_s'] / run['create_s'], 2)
+        run['resize_s'] = round(run['resize_s'], 3)
+        run['create_s'] = round(run['create_s'], 3)
+
+    return {'frames': args.frames, 'pool': args.pool, 'cpu_count': os.cpu_count(), 'runs': runs}
+
+
+def preset_corpus() -> dict:
+    corpus = {
+        'png_640x480': make_png(),
+        'jpeg_1080': make_photo(1080, 1080),
+        'gif_60f': make_gif(60),
+    }
+    if shutil.which('ffmpeg'):
+        corpus['mp4_2mb'] = make_mp4(2)
+    return corpus
+
+
+def cmd_presets(args) -> dict:
+    corpus = preset_corpus()
+    presets = [None] + list(StickerConverter.PRESETS)
+    converter = StickerConverter()
+
+    rows = []
+    for name, media in corpus.items():
+        for preset in presets:
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                output = converter.create_sticker(media, use_cache=False, preset=preset)
+                times.append(time.perf_counter() - start)
+            rows.append({
+                'input': name,
+                'preset': preset or 'legacy',
+                'encode_s': round(min(times), 3),
+                'output_bytes': len(output),
+            })
+    return {'repeat': args.repeat, 'rows': rows}
+
+
+def make_cartoon_gif(frames: int, size: int = 480, duration: int = 66) -> bytes:
+    """Flat-colour GIF: a few shapes moving over a static scene, like most meme/cartoon GIFs"""
+    scene = Image.new('RGB', (size, size), (250, 240, 210))
+    draw = ImageDraw.Draw(scene)
+    draw.rectangle((0, size * 2 // 3, size, size), fill=(90, 170, 80))
+    draw.ellipse((size - 140, 30, size - 40, 130), fill=(255, 200, 40))
+    images = []
+    for i in range(frames):
+        img = scene.copy()
+        d = ImageDraw.Draw(img)
+        x = (i * 9) % (size - 120)
+        d.rounded_rectangle((x, size // 3, x + 120, size // 3 + 140), 30, fill=(220, 60, 60), outline=(0, 0, 0), width=4)
+        d.ellipse((x + 25, size // 3 + 30, x + 50, size // 3 + 55), fill=(255, 255, 255), outline=(0, 0, 0), width=3)
+        d.ellipse((x + 70, size // 3 + 30, x + 95, size // 3 + 55), fill=(255, 255, 255), outline=(0, 0, 0), width=3)
+        images.append(img)
+    output = io.BytesIO()
+    images[0].save(output, format='GIF', save_all=True, append_images=images[1:], duration=duration, loop=0)
+    return output.getvalue()
+
+
+def make_photo_gif(frames: int, size: int = 480, duration: int = 66) -> bytes:
+    """Photo-like GIF (dithered, hundreds of colours): the case auto should leave lossy"""
+    base = Image.open(io.BytesIO(make_photo(size, size))).convert('RGB')
+    images = [base.rotate(i * 2) for i in range(frames)]
+    output = io.BytesIO()
+    images[0].save(output, format='GIF', save_all=True, append_images=images[1:], duration=duration, loop=0)
+    return output.getvalue()
+
+
+def cmd_palette(args) -> dict:
+    corpus = {
+        'ball': make_gif(args.frames),
+        'cartoon': make_cartoon_gif(args.frames),
+        'photo': make_photo_gif(args.frames),
+    }
+    converter = StickerConverter()
+
+    rows = []
+    for name, media in corpus.items():
+        for encoding in StickerConverter.ENCODINGS:
+            times = []
+            for _ in range(args.repeat):
+                info = {}
+                start = time.perf_counter()
+                output = converter.create_sticker(media, use_cache=False, preset='balanced', encoding=encoding, info=info)
+                times.append(time.perf_counter() - start)
+            rows.append({
+                'input': name,
+                'encoding': encoding,
+                'mode': info['encoding']['mode'],
+                'detected': info['encoding'].get('detected'),
+                'encode_s': round(min(times), 3),
+                'output_bytes': len(output),
+            })
+    return {'frames': args.frames, 'repeat': args.repeat, 'rows': rows}
+
+
+def legacy_attach_exif(webp_data: bytes, exif_data: bytes) -> bytes:
+    """The previous _attach_exif_to_webp: slices every chunk, BytesIO rebuild, RIFF size patch"""
+    chunks = []
+    pos = 12
+    while pos < len(webp_data):
+        if pos + 8 > len(webp_data):
+            break
+        chunk_fourcc = webp_data[pos:pos+4]
+        chunk_size = struct.unpack('<I', webp_data[pos+4:pos+8])[0]
+        chunk_data = webp_data[pos+8:pos+8+chunk_size]
+        if chunk_fourcc != b'EXIF':
+            chunks.append((chunk_fourcc, chunk_data))
+        pos += 8 + chunk_size
+        if chunk_size % 2 == 1:
+            pos += 1
+
+    insert_pos = 1 if len(chunks) > 0 else 0
+    chunks.insert(insert_pos, (b'EXIF', exif_data))
+
+    output = io.BytesIO()
+    output.write(b'RIFF')
+    output.write(b'\x00\x00\x00\x00')
+    output.write(b'WEBP')
+    for fourcc, data in chunks:
+        output.write(fourcc)
+        output.write(struct.pack('<I', len(data)))
+        output.write(data)
+        if len(data) % 2 == 1:
+            output.write(b'\x00')
+    result = output.getvalue()
+    file_size = len(result) - 8
+    return result[:4] + struct.pack('<I', file_size) + result[8:]
+
+
+def time_attach(fn, webp: bytes, exif: bytes, iterations: int) -> dict:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(webp, exif)
+    per_call = (time.perf_counter() - start) / iterations
+
+    tracemalloc.start()
+    fn(webp, exif)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'us_per_call': round(per_call * 1e6, 1), 'peak_alloc_bytes': peak}
+
+
+def cmd_exif(args) -> dict:
+    # Large animated WebP: noisy frames keep the chunks big
+    frames = [Image.effect_noise((512, 512), 60 + i).convert('RGBA') for i in range(40)]
+    output = io.BytesIO()
+    frames[0].save(output, format='WEBP', save_all=True, append_images=frames[1:], quality=90, method=0)
+    webp = output.getvalue()
+    exif = StickerConverter._build_whatsapp_exif('bench', 'bench', ['x'])
+
+    build_us = {}
+    for label, stable in (('random_id', False), ('stable_id', True)):
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            StickerConverter._build_whatsapp_exif('bench', 'bench', ['x'], stable)
+        build_us[label] = round((time.perf_counter() - start) / args.iterations * 1e6, 2)
+
+    return {
+        'webp_bytes': len(webp),
+        'iterations': args.iterations,
+        'legacy': time_attach(legacy_attach_exif, webp, exif, args.iterations),
+        'memoryview': time_attach(StickerConverter._attach_exif_to_webp, webp, exif, args.iterations),
+        'build_us': build_us,
+    }
+
+
+def legacy_trim(path: str, start: float, duration: float, fps: int) -> bytes:
+    """Output-side seek with full-rate scaling, as the FFmpeg path did before input seeking"""
+    target = StickerConverter.TARGET_SIZE
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-i', f'file:{path}',
+        '-ss', f'{start:.3f}',
+        '-vf', f"scale={target}:{target}:force_original_aspect_ratio=decrease,"
+               f"pad={target}:{target}:(ow-iw)/2:(oh-ih)/2:color=0x00000000,format=yuva420p",
+        '-c:v', 'libwebp', '-lossless', '0', '-compression_level', '4',
+        '-q:v', str(100 - StickerConverter.DEFAULT_QUALITY), '-loop', '0', '-an',
+        '-r', str(fps), '-t', str(duration),
+        '-f', 'webp', 'pipe:1'
+    ]
+    return subprocess.run(cmd, capture_output=True, check=True).stdout
+
+
+def cmd_seek(args) -> dict:
+    converter = StickerConverter()
+    duration = StickerConverter.MAX_DURATION_SEC
+    fps = StickerConverter.DEFAULT_FPS
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'clip.mp4')
+        make_clip(path, args.seconds, args.size, args.rate)
+
+        start = time.perf_counter()
+        legacy = legacy_trim(path, args.start, duration, fps)
+        legacy_wall = time.perf_counter() - start
+
+        start = time.perf_counter()
+        output = converter.create_sticker(
+            path, start_time=args.start, end_time=args.start + duration,
+            preset='balanced', use_cache=False
+        )
+        seek_wall = time.perf_counter() - start
+
+    return {
+        'source': {'size': args.size, 'fps': args.rate, 'seconds': args.seconds, 'start': args.start},
+        'output_side_seek': {'wall_s': round(legacy_wall, 3), **describe_webp(legacy)},
+        'input_side_seek': {'wall_s': round(seek_wall, 3), **describe_webp(output)},
+        'saved_s': round(legacy_wall - seek_wall, 3),
+    }
+
+
+def cmd_profile(args) -> dict:
+    converter = StickerConverter()
+    request = {
+        'command': 'create',
+        'input': base64.b64encode(make_gif(args.frames)).decode('ascii'),
+        'options': {'cache': False},
+    }
+
+    walls = {False: [], True: []}
+    report = None
+    # Interleaved so drift hits both sides equally
+    for _ in range(args.repeat):
+        for profile in (False, True):
+            start = time.perf_counter()
+            _, extra = handle_request(converter, {**request, 'profile': profile})
+            walls[profile].append(time.perf_counter() - start)
+            report = extra.get('profile', report)
+
+    plain, profiled = min(walls[False]), min(walls[True])
+    return {
+        'frames': args.frames,
+        'wall_s': {'plain': round(plain, 4), 'profiled': round(profiled, 4)},
+        'overhead_pct': round((profiled - plain) / plain * 100, 2),
+        'profile': report,
+    }
+
+
+# Typical phone camera / screenshot / chat-app sizes
+PHOTO_SIZES = (
+    ('12mp_landscape', 4032, 3024),
+    ('12mp_portrait', 3024, 4032),
+    ('48mp_binned', 4000, 3000),
+    ('screenshot', 1080, 2400),
+    ('chat_forward', 1280, 960),
+    ('square_2048', 2048, 2048),
+)
+
+
+def photo_corpus() -> dict:
+    corpus = {name: make_photo(w, h) for name, w, h in PHOTO_SIZES}
+    corpus['png_512'] = make_png(512, 512)
+    return corpus
+
+
+def cmd_photos(args) -> dict:
+    results = {}
+    totals = {'legacy_ms': 0.0, 'fast_ms': 0.0}
+    for name, data in photo_corpus().items():
+        row = {'input_bytes': len(data)}
+        for crop in (False, True):
+            timings = {}
+            outputs = {}
+            for label, resize in (('legacy', StickerConverter._resize_image), ('fast', StickerConverter._resize_static)):
+                best = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    # Decode is part of the cost: draft() only pays off before load
+                    outputs[label] = resize(Image.open(io.BytesIO(data)), crop)
+                    # An untouched 512x512 input comes back still lazy
+                    outputs[label].load()
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[label] = best * 1000
+                totals[f'{label}_ms'] += best * 1000
+
+            diff = ImageStat.Stat(ImageChops.difference(
+                outputs['legacy'].convert('RGBA'), outputs['fast'].convert('RGBA')
+            )).mean
+            row['crop' if crop else 'fit'] = {
+                'legacy_ms': round(timings['legacy'], 2),
+                'fast_ms': round(timings['fast'], 2),
+                'speedup': round(timings['legacy'] / timings['fast'], 2),
+                'mean_abs_diff': round(sum(diff) / len(diff), 3),
+            }
+        results[name] = row
+
+    return {
+        'photos': results,
+        'total': {
+            'legacy_ms': round(totals['legacy_ms'], 2),
+            'fast_ms': round(totals['fast_ms'], 2),
+            'speedup': round(totals['legacy_ms'] / totals['fast_ms'], 2),
+        },
+    }
+
+
+def suite_corpus() -> Tuple[dict, List[str]]:
+    """
+    The fixed benchmark corpus: (name -> bytes, names skipped for lack of FFmpeg).
+    Everything is generated, so the same commit always sees the same inputs.
+    """
+    corpus = {
+        'png_256': make_png(256, 256),
+        'png_1024': make_photo(1024, 768, 'PNG'),
+        'jpeg_640': make_photo(640, 480),
+        'jpeg_1080p': make_photo(1920, 1080),
+        'jpeg_12mp': make_photo(4032, 3024),
+        'gif_small': make_gif(30, size=240),
+        'gif_long': make_gif(225),
+    }
+    skipped = []
+    for fmt in ('mp4', 'webm'):
+        if shutil.which('ffmpeg'):
+            corpus[f'{fmt}_720p'] = make_video(fmt)
+        else:
+            skipped.append(f'{fmt}_720p')
+    return corpus, skipped
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _child_suite(conn, media: bytes, kwargs: dict, repeat: int):
+    converter = StickerConverter()
+    base_rss = peak_rss_kb()
+    latencies = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(converter.create_sticker(media, use_cache=False, **kwargs))
+        latencies.append(time.perf_counter() - start)
+    conn.send({'latencies': latencies, 'rss_delta_kb': peak_rss_kb() - base_rss, 'output_bytes': size})
+    conn.close()
+
+
+def suite_run(media: bytes, repeat: int, **kwargs) -> dict:
+    """`repeat` create_sticker calls in a fresh process (clean peak RSS), summarised"""
+    ctx = multiprocessing.get_context('spawn')
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child_suite, args=(child, media, kwargs, repeat))
+    proc.start()
+    result = parent.recv()
+    proc.join()
+
+    latencies = result['latencies']
+    return {
+        'runs': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'throughput_per_s': round(len(latencies) / sum(latencies), 3),
+        'peak_rss_delta_kb': result['rss_delta_kb'],
+        'output_bytes': result['output_bytes'],
+    }
+
+
+def suite_environment() -> dict:
+    """What a reader needs to judge whether two reports are comparable"""
+    env = {
+        'python': platform.python_version(),
+        'pillow': Image.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'ffmpeg': None,
+        'commit': None,
+    }
+    if shutil.which('ffmpeg'):
+        out = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout
+        env['ffmpeg'] = out.split('\n', 1)[0]
+    try:
+        env['commit'] = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return env
+
+
+def compare_rows(rows: List[dict], baseline: dict) -> List[dict]:
+    """Ratios against a previous suite report (below 1.0 is faster / smaller)"""
+    previous = {(r['input'], r['preset']): r for r in baseline.get('rows', [])}
+    deltas = []
+    for row in rows:
+        old = previous.get((row['input'], row['preset']))
+        if old is None or old.get('sha256') != row['sha256']:
+            continue
+        deltas.append({
+            'input': row['input'],
+            'preset': row['preset'],
+            'p50': round(row['p50_ms'] / old['p50_ms'], 3) if old['p50_ms'] else None,
+            'p95': round(row['p95_ms'] / old['p95_ms'], 3) if old['p95_ms'] else None,
+            'output_bytes': round(row['output_bytes'] / old['output_bytes'], 3) if old['output_bytes'] else None,
+            'peak_rss_delta_kb': row['peak_rss_delta_kb'] - old['peak_rss_delta_kb'],
+        })
+    return deltas
+
+
+def cmd_suite(args) -> dict:
+    corpus, skipped = suite_corpus()
+    if args.only:
+        corpus = {name: data for name, data in corpus.items() if name in args.only}
+    presets = [None] + list(StickerConverter.PRESETS)
+
+    rows = []
+    for name, media in corpus.items():
+        digest = hashlib.sha256(media).hexdigest()[:16]
+        for preset in presets:
+            rows.append({
+                'input': name,
+                'preset': preset or 'legacy',
+                'input_bytes': len(media),
+                'sha256': digest,
+                **suite_run(media, args.repeat, preset=preset),
+            })
+
+    summary = {}
+    for preset in presets:
+        label = preset or 'legacy'
+        selected = [r for r in rows if r['preset'] == label]
+        if selected:
+            summary[label] = {
+                'total_p50_ms': round(sum(r['p50_ms'] for r in selected), 2),
+                'total_output_bytes': sum(r['output_bytes'] for r in selected),
+                'max_peak_rss_delta_kb': max(r['peak_rss_delta_kb'] for r in selected),
+            }
+
+    report = {
+        'environment': suite_environment(),
+        'repeat': args.repeat,
+        'skipped': skipped,
+        'rows': rows,
+        'summary': summary,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['baseline'] = baseline.get('environment', {}).get('commit')
+        report['delta'] = compare_rows(rows, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def make_animated_webp(frames: int, size: int = 512) -> bytes:
+    """Sticker-shaped animated WebP built from the benchmark GIF"""
+    gif = Image.open(io.BytesIO(make_gif(frames, size=size)))
+    images = []
+    for i in range(gif.n_frames):
+        gif.seek(i)
+        images.append(gif.convert('RGBA'))
+    output = io.BytesIO()
+    images[0].save(output, format='WEBP', save_all=True, append_images=images[1:], duration=66, quality=80, method=0)
+    return output.getvalue()
+
+
+def tempfile_to_image(webp: bytes) -> bytes:
+    """Baseline: sticker to disk, decode from the file, PNG to disk, read it back"""
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'in.webp')
+        dst = os.path.join(tmp, 'out.png')
+        with open(src, 'wb') as f:
+            f.write(webp)
+        Image.open(src).save(dst, format='PNG')
+        with open(dst, 'rb') as f:
+            return f.read()
+
+
+def tempfile_to_video(webp: bytes, fps: int = 30) -> bytes:
+    """Baseline: every frame to a PNG file, ffconcat list with durations, MP4 file read back"""
+    with tempfile.TemporaryDirectory() as tmp:
+        img = Image.open(io.BytesIO(webp))
+        durations = StickerConverter._webp_animation_info(webp)['durations'] or [1000]
+        lines = ['ffconcat version 1.0']
+        for i in range(getattr(img, 'n_frames', 1)):
+            img.seek(i)
+            path = os.path.join(tmp, f'{i:05d}.png')
+            StickerConverter._flatten(img, (255, 255, 255)).save(path, format='PNG', compress_level=1)
+            lines += [f'file {path}', f'duration {durations[i] / 1000:.3f}']
+        listing = os.path.join(tmp, 'frames.txt')
+        with open(listing, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        out = os.path.join(tmp, 'out.mp4')
+        subprocess.run([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', listing,
+            '-vf', f'fps={fps},pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart', out
+        ], capture_output=True, check=True)
+        with open(out, 'rb') as f:
+            return f.read()
+
+
+def time_reverse(fn, webp: bytes, repeat: int) -> dict:
+    best = None
+    tracemalloc.start()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn(webp)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'wall_ms': round(best * 1000, 2), 'peak_alloc_kb': peak // 1024, 'output_bytes': len(output)}
+
+
+def cmd_reverse(args) -> dict:
+    webp = make_animated_webp(args.frames)
+    converter = StickerConverter()
+    report = {
+        'input': {'frames': args.frames, 'bytes': len(webp)},
+        'toImage': {
+            'tempfile': time_reverse(tempfile_to_image, webp, args.repeat),
+            'direct': time_reverse(lambda data: converter.to_image(data), webp, args.repeat),
+        },
+    }
+    if shutil.which('ffmpeg'):
+        report['toVideo'] = {
+            'tempfile': time_reverse(tempfile_to_video, webp, args.repeat),
+            'pipe': time_reverse(lambda data: converter.to_video(data), webp, args.repeat),
+        }
+    else:
+        report['toVideo'] = 'skipped: ffmpeg not found'
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sticker.py benchmarks')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('serve', help='one-shot main() vs persistent --serve worker')
+    p.add_argument('--requests', type=int, default=50)
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser('transport', help='base64-in-JSON vs binary framing, wall time and peak RSS')
+    p.add_argument('--input', help='media file to convert (default: synthetic MP4 via ffmpeg)')
+    p.add_argument('--size-mb', type=int, default=10)
+    p.set_defaults(func=cmd_transport)
+
+    p = sub.add_parser('stream-memory', help='frame list vs streaming animated encode, peak RSS')
+    p.add_argument('--frames', type=int, default=225)
+    p.set_defaults(func=cmd_stream_memory)
+
+    p = sub.add_parser('resample', help='time-based frame sampling on a high-fps GIF')
+    p.add_argument('--source-fps', type=int, default=50)
+    p.add_argument('--seconds', type=int, default=4)
+    p.set_defaults(func=cmd_resample)
+
+    p = sub.add_parser('parallel', help='per-frame resize scaling from 1 to N workers')
+    p.add_argument('--frames', type=int, default=200)
+    p.add_argument('--max-workers', type=int, default=0, help='default: cpu count')
+    p.add_argument('--pool', choices=('thread', 'process'), default='thread')
+    p.set_defaults(func=cmd_parallel)
+
+    p = sub.add_parser('presets', help='encode time vs output bytes per encoder preset')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=cmd_presets)
+
+    p = sub.add_parser('exif', help='EXIF attach (legacy vs memoryview) and build (random vs memoised stable id)')
+    p.add_argument('--iterations', type=int, default=200)
+    p.set_defaults(func=cmd_exif)
+
+    p = sub.add_parser('seek', help='output-side trim vs input-side seek + pre-scale fps on a long clip')
+    p.add_argument('--seconds', type=int, default=120)
+    p.add_argument('--start', type=float, default=90)
+    p.add_argument('--size', default='1920x1080')
+    p.add_argument('--rate', type=int, default=60)
+    p.set_defaults(func=cmd_seek)
+
+    p = sub.add_parser('profile', help='create with and without the profile flag, overhead and a sample report')
+    p.add_argument('--frames', type=int, default=60)
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=cmd_profile)
+
+    p = sub.add_parser('photos', help='decode + resize of phone-sized photos, legacy vs static fast path')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=cmd_photos)
+
+    p = sub.add_parser('suite', help='golden corpus x encoder presets: p50/p95, throughput, peak RSS, output size')
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--only', nargs='+', metavar='NAME', help='corpus entries to run (default: all)')
+    p.add_argument('--output', help='also write the report to this file')
+    p.add_argument('--baseline', help='earlier suite report to compare against')
+    p.set_defaults(func=cmd_suite)
+
+    p = sub.add_parser('reverse', help='toImage/toVideo against temp-file baselines')
+    p.add_argument('--frames', type=int, default=90)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=cmd_reverse)
+
+    p = sub.add_parser('palette', help='lossy vs mixed vs palette lossless vs auto on flat and photo GIFs')
+    p.add_argument('--frames', type=int, default=45)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=cmd_palette)
+
+    args = parser.parse_args()
+    print(json.dumps(args.func(args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,700 @@
 #!/usr/bin/env python3
 import io
+import os
 import json
 import sys
 import base64
+import ctypes
+import ctypes.util
+import functools
+import hashlib
+import math
 import secrets
 import struct
+import resource
 import subprocess
-from typing import List
-from PIL import Image
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+from PIL import Image, features
+
+# Frame header for --serve/--binary modes: JSON header length, 4-byte big endian
+FRAME_HEADER = struct.Struct('>I')
+
+COMMANDS = ('create', 'addExif', 'stats', 'toImage', 'toVideo')
+
+# Items of one createBatch converted at the same time unless the request says otherwise
+BATCH_CONCURRENCY = min(4, os.cpu_count() or 1)
+
+# Upper bounds for request-supplied `workers` / `concurrency`. Every distinct
+# value gets its own cached pool for the life of the worker, so they must stay few.
+# Batch items mostly wait on FFmpeg, so a batch may go past the CPU count a little.
+MAX_WORKERS = os.cpu_count() or 1
+MAX_BATCH_CONCURRENCY = max(4, MAX_WORKERS)
+
+# Media handed to FFmpeg: raw bytes, a file path, or an open file descriptor
+VideoSource = Union[bytes, str, int]
+
+def peak_rss_kb() -> int:
+    """Peak RSS of this process in KB (VmHWM; ru_maxrss may carry the parent's peak across exec)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+@functools.lru_cache(maxsize=None)
+def _libc():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c'))
+    except OSError:
+        return None
+
+def reset_peak_rss() -> bool:
+    """
+    Reset VmHWM to the current RSS (Linux 4.0+); False when the kernel does not allow it.
+    Freed heap is handed back first (glibc malloc_trim), otherwise a long-lived
+    worker would reuse the previous request's pages without RSS ever growing.
+    """
+    malloc_trim = getattr(_libc(), 'malloc_trim', None)
+    if malloc_trim is not None:
+        malloc_trim(0)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+class Profiler:
+    """
+    Opt-in per-stage accounting for one request: wall time, CPU time (this
+    process plus finished FFmpeg children), peak RSS growth and frame counts.
+    Stages nest and a parent keeps only what its children did not use, so the
+    stages add up to the total. CPU time is process-wide, so concurrent batch
+    items see each other's work.
+    Peak RSS is process-wide too and never goes down, so it is reset per
+    profiler. `rss=False` leaves it out entirely: concurrent batch items would
+    reset each other's baseline and count each other's memory. Where the reset
+    is not possible only the first profiler of the process (a one-shot run)
+    reports RSS, since later ones would only see the earlier peak.
+    """
+    _current = threading.local()
+    _profiled = False
+    _profiled_lock = threading.Lock()
+
+    def __init__(self, rss: bool = True):
+        self.stages = {}
+        # [child wall, child cpu, child rss] per open stage
+        self._stack = []
+        self._wall = time.perf_counter()
+        self._cpu = self._cpu_time()
+        self.track_rss = False
+        if rss:
+            with Profiler._profiled_lock:
+                self.track_rss = reset_peak_rss() or not Profiler._profiled
+                Profiler._profiled = True
+        self._rss = peak_rss_kb() if self.track_rss else 0
+
+    @staticmethod
+    def _cpu_time() -> float:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return time.process_time() + children.ru_utime + children.ru_stime
+
+    @classmethod
+    def active(cls) -> Optional['Profiler']:
+        return getattr(cls._current, 'profiler', None)
+
+    @contextmanager
+    def activate(self):
+        """Make this profiler the one `stage()` reports to on the current thread"""
+        previous = self.active()
+        self._current.profiler = self
+        try:
+            yield self
+        finally:
+            self._current.profiler = previous
+
+    @contextmanager
+    def measure(self, name: str, rss: bool = True):
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = {'wall_ms': 0.0, 'cpu_ms': 0.0, 'rss_kb': 0, 'calls': 0, 'frames': 0}
+        children = [0.0, 0.0, 0]
+        self._stack.append(children)
+        rss = rss and self.track_rss
+        rss_before = peak_rss_kb() if rss else 0
+        wall_before = time.perf_counter()
+        cpu_before = self._cpu_time()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - wall_before
+            cpu = self._cpu_time() - cpu_before
+            grown = max(0, peak_rss_kb() - rss_before) if rss else 0
+            self._stack.pop()
+            if self._stack:
+                parent = self._stack[-1]
+                parent[0] += wall
+                parent[1] += cpu
+                parent[2] += grown
+            record['wall_ms'] += (wall - children[0]) * 1000
+            record['cpu_ms'] += (cpu - children[1]) * 1000
+            record['rss_kb'] += max(0, grown - children[2])
+            record['calls'] += 1
+
+    def report(self) -> dict:
+        stages = {}
+        for name, record in self.stages.items():
+            entry = {
+                'wall_ms': round(record['wall_ms'], 3),
+                'cpu_ms': round(record['cpu_ms'], 3),
+                'calls': record['calls'],
+            }
+            if self.track_rss:
+                entry['rss_kb'] = record['rss_kb']
+            if record['frames']:
+                entry['frames'] = record['frames']
+            stages[name] = entry
+        report = {
+            'stages': stages,
+            'wall_ms': round((time.perf_counter() - self._wall) * 1000, 3),
+            'cpu_ms': round((self._cpu_time() - self._cpu) * 1000, 3),
+        }
+        if self.track_rss:
+            report['rss_kb'] = max(0, peak_rss_kb() - self._rss)
+        return report
+
+@contextmanager
+def stage(name: str, rss: bool = True):
+    """
+    Time a pipeline stage when a Profiler is active on this thread, else do nothing.
+    Yields the stage record (add to its 'frames') or None.
+    `rss=False` skips the /proc read for stages that run once per frame.
+    """
+    profiler = Profiler.active()
+    if profiler is None:
+        yield None
+        return
+    with profiler.measure(name, rss) as record:
+        yield record
+
+class StickerCache:
+    """
+    On-disk LRU cache of finished stickers *without* EXIF, keyed by a hash of
+    the input bytes plus every option that affects pixels.
+    Recency is tracked through file mtime so it survives restarts.
+    """
+    # Bump when the encode pipeline changes so stale entries stop matching
+    VERSION = 4
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+    DEFAULT_MAX_ENTRIES = 2000
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_entries: int = DEFAULT_MAX_ENTRIES
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        # key -> size, oldest first
+        self._index = OrderedDict()
+        # Batch items share one cache from several threads
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith('.webp'):
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name[:-5], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self.total_bytes += size
+        self._evict()
+
+    @classmethod
+    def from_env(cls) -> Optional['StickerCache']:
+        """Build the cache from STICKER_CACHE_* environment variables, or None when disabled"""
+        directory = os.environ.get('STICKER_CACHE_DIR')
+        if not directory:
+            return None
+        max_mb = int(os.environ.get('STICKER_CACHE_MAX_MB', cls.DEFAULT_MAX_BYTES // (1024 * 1024)))
+        max_entries = int(os.environ.get('STICKER_CACHE_MAX_ENTRIES', cls.DEFAULT_MAX_ENTRIES))
+        return cls(directory, max_mb * 1024 * 1024, max_entries)
+
+    @classmethod
+    def key(cls, source: Union[bytes, str], **options) -> str:
+        """Content address for `source` (bytes, or a file path hashed in chunks) rendered with `options`"""
+        h = hashlib.sha256()
+        h.update(json.dumps([cls.VERSION, options], sort_keys=True).encode('utf-8'))
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+        else:
+            h.update(source)
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.webp')
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # Missing, or evicted by another worker sharing the directory
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key not in self._index:
+                self._index[key] = len(data)
+                self.total_bytes += len(data)
+            self._index.move_to_end(key)
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._forget(key)
+            self._index[key] = len(data)
+            self.total_bytes += len(data)
+            self._evict()
+
+    def _forget(self, key: str) -> None:
+        size = self._index.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def _evict(self) -> None:
+        while self._index and (
+            len(self._index) > self.max_entries or self.total_bytes > self.max_bytes
+        ):
+            key, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._index),
+            'bytes': self.total_bytes,
+        }
+
+class MediaProbe:
+    """
+    Format detection done once per input, before any decoder runs.
+    A signature table recognises the common containers from the first bytes;
+    anything else can optionally be identified by one ffprobe run whose
+    result is remembered. Counts every route taken and every time the
+    Pillow -> FFmpeg fallback fires.
+    """
+    HEAD_SIZE = 4096
+    # Bytes of an in-memory input handed to ffprobe
+    PROBE_BYTES = 1024 * 1024
+    MAX_PROBES = 256
+
+    # (kind, offset, magic) checked in order
+    MAGIC = (
+        ('gif', 0, b'GIF87a'),
+        ('gif', 0, b'GIF89a'),
+        ('png', 0, b'\x89PNG\r\n\x1a\n'),
+        ('jpeg', 0, b'\xff\xd8\xff'),
+        ('matroska', 0, b'\x1a\x45\xdf\xa3'),
+        ('bmp', 0, b'BM'),
+        ('tiff', 0, b'II*\x00'),
+        ('tiff', 0, b'MM\x00*'),
+    )
+    # ISO base media brands that are not plain MP4
+    BRANDS = {
+        b'qt  ': 'mov',
+        b'avif': 'avif',
+        b'avis': 'avif-sequence',
+        b'heic': 'heic',
+        b'heix': 'heic',
+        b'heim': 'heic',
+        b'heis': 'heic',
+        b'hevc': 'heic-sequence',
+        b'hevx': 'heic-sequence',
+    }
+    # Top-level QuickTime atoms of files written without an ftyp box
+    MOV_ATOMS = (b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot')
+
+    _PIL_AVIF = features.check('avif')
+
+    # kind -> (engine, animated); animated None means Pillow decides from the frames
+    ROUTES = {
+        'gif': ('pil', None),
+        'png': ('pil', False),
+        'apng': ('pil', True),
+        'jpeg': ('pil', False),
+        'bmp': ('pil', False),
+        'tiff': ('pil', False),
+        'webp': ('pil', False),
+        # FFmpeg cannot decode animated WebP, so Pillow is the only engine here
+        'webp-animated': ('pil', True),
+        'avif': ('pil', False) if _PIL_AVIF else ('ffmpeg', False),
+        'avif-sequence': ('pil', True) if _PIL_AVIF else ('ffmpeg', True),
+        'heic': ('ffmpeg', False),
+        'heic-sequence': ('ffmpeg', True),
+        'mp4': ('ffmpeg', True),
+        'mov': ('ffmpeg', True),
+        'webm': ('ffmpeg', True),
+        'matroska': ('ffmpeg', True),
+    }
+
+    def __init__(self, ffprobe: bool = False, max_probes: int = MAX_PROBES):
+        self.ffprobe = ffprobe
+        self.max_probes = max_probes
+        self.routes = {'pil': 0, 'ffmpeg': 0}
+        self.kinds = {}
+        self.fallbacks = 0
+        self.probe_hits = 0
+        self.probe_misses = 0
+        self.probe_failures = 0
+        # probe key -> kind, oldest first
+        self._probes = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'MediaProbe':
+        """STICKER_FFPROBE=1 identifies unknown inputs with ffprobe instead of trial decoding"""
+        return cls(ffprobe=os.environ.get('STICKER_FFPROBE', '').lower() in ('1', 'true', 'yes'))
+
+    @classmethod
+    def sniff(cls, head: bytes) -> Optional[str]:
+        """Media kind from the first bytes of a file, or None when no signature matches"""
+        for kind, offset, magic in cls.MAGIC:
+            if head[offset:offset + len(magic)] == magic:
+                if kind == 'png':
+                    return 'apng' if cls._png_animated(head) else 'png'
+                if kind == 'matroska':
+                    # EBML DocType sits in the header element
+                    return 'webm' if b'webm' in head[:64] else 'matroska'
+                return kind
+
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            # VP8X flags: 0x02 = animation
+            if head[12:16] == b'VP8X' and len(head) > 20 and head[20] & 0x02:
+                return 'webp-animated'
+            return 'webp'
+
+        if head[4:8] == b'ftyp':
+            size = int.from_bytes(head[:4], 'big')
+            major = head[8:12]
+            compatible = [head[i:i + 4] for i in range(16, min(size, len(head)) - 3, 4)]
+            for brand in (major, *compatible):
+                if brand in cls.BRANDS and cls.BRANDS[brand] != 'mov':
+                    return cls.BRANDS[brand]
+            return cls.BRANDS.get(major, 'mp4')
+
+        if head[4:8] in cls.MOV_ATOMS:
+            return 'mov'
+        return None
+
+    @staticmethod
+    def _png_animated(head: bytes) -> bool:
+        """An acTL chunk ahead of the first IDAT marks an APNG"""
+        pos = 8
+        while pos + 8 <= len(head):
+            length = int.from_bytes(head[pos:pos + 4], 'big')
+            chunk = head[pos + 4:pos + 8]
+            if chunk == b'acTL':
+                return True
+            if chunk == b'IDAT':
+                return False
+            pos += 12 + length
+        return False
+
+    def detect(self, source: Union[bytes, str]) -> dict:
+        """
+        Identify `source` (bytes or a file path) and pick its engine.
+        Returns {'kind', 'engine', 'animated'}; kind is None when nothing matched.
+        """
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                head = f.read(self.HEAD_SIZE)
+        else:
+            head = source[:self.HEAD_SIZE]
+
+        kind = self.sniff(head)
+        if kind is None and self.ffprobe:
+            kind = self._cached_probe(source)
+
+        # Unknown: Pillow first, FFmpeg as the fallback
+        engine, animated = self.ROUTES.get(kind, ('pil', None))
+        with self._lock:
+            self.routes[engine] += 1
+            label = kind or 'unknown'
+            self.kinds[label] = self.kinds.get(label, 0) + 1
+        return {'kind': kind, 'engine': engine, 'animated': animated}
+
+    def record_fallback(self) -> None:
+        with self._lock:
+            self.fallbacks += 1
+
+    def _cached_probe(self, source: Union[bytes, str]) -> Optional[str]:
+        """ffprobe `source` once; results are kept per content (or path + mtime)"""
+        if isinstance(source, str):
+            st = os.stat(source)
+            key = ('path', os.path.realpath(source), st.st_size, st.st_mtime_ns)
+        else:
+            key = ('data', len(source), hashlib.sha1(source[:self.PROBE_BYTES]).digest())
+
+        with self._lock:
+            if key in self._probes:
+                self._probes.move_to_end(key)
+                self.probe_hits += 1
+                return self._probes[key]
+            self.probe_misses += 1
+
+        try:
+            kind = self._run_ffprobe(source)
+        except Exception:
+            kind = None
+            with self._lock:
+                self.probe_failures += 1
+
+        with self._lock:
+            self._probes[key] = kind
+            while len(self._probes) > self.max_probes:
+                self._probes.popitem(last=False)
+        return kind
+
+    def _run_ffprobe(self, source: Union[bytes, str]) -> Optional[str]:
+        """Map ffprobe's view of `source` onto a routable kind"""
+        if isinstance(source, str):
+            input_arg, feed = f'file:{source}', None
+        else:
+            input_arg = 'pipe:0'
+            feed = StickerConverter._chunked(source[:self.PROBE_BYTES])
+        cmd = [
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'format=format_name:stream=codec_type',
+            '-of', 'json',
+            input_arg
+        ]
+        result = json.loads(StickerConverter._run_ffmpeg(cmd, feed=feed, timeout=10) or b'{}')
+
+        if not any(s.get('codec_type') == 'video' for s in result.get('streams', [])):
+            return None
+        format_name = result.get('format', {}).get('format_name', '')
+        # Single images come through the image2 demuxers; leave those to Pillow
+        if format_name == 'image2' or format_name.endswith('_pipe'):
+            return None
+        return 'matroska' if 'matroska' in format_name else 'mp4'
+
+    @staticmethod
+    def duration_ms(source: Union[bytes, str]) -> Optional[float]:
+        """Playback length of `source` from ffprobe's format=duration, or None if unknown"""
+        if isinstance(source, str):
+            input_arg, feed = f'file:{source}', None
+        else:
+            # The whole input: an MP4 may keep its moov box at the end
+            input_arg, feed = 'pipe:0', StickerConverter._chunked(source)
+        cmd = [
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'json',
+            input_arg
+        ]
+        try:
+            result = json.loads(StickerConverter._run_ffmpeg(cmd, feed=feed, timeout=10) or b'{}')
+            return float(result['format']['duration']) * 1000
+        except Exception:
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'routes': dict(self.routes),
+                'kinds': dict(self.kinds),
+                'fallbacks': self.fallbacks,
+                'probes': {
+                    'hits': self.probe_hits,
+                    'misses': self.probe_misses,
+                    'failures': self.probe_failures,
+                    'cached': len(self._probes),
+                },
+            }
+
+class FrameStream(Image.Image):
+    """
+    Lazy multi-frame image for Pillow's animated WebP writer.
+    The writer seeks through `n_frames` and hands each frame to the encoder
+    right away, so rendering on seek() keeps one decoded frame alive at a time.
+    """
+
+    def __init__(self, render: Callable[[int], Image.Image], n_frames: int):
+        super().__init__()
+        self._render = render
+        self.n_frames = n_frames
+        self._frame = None
+        self._index = -1
+
+    def seek(self, frame: int) -> None:
+        if frame == self._index:
+            return
+        try:
+            current = self._render(frame)
+        except EOFError:
+            # Source ended early: hold the last good frame
+            if self._frame is None:
+                raise
+            current = self._frame
+        self._frame = current
+        self._index = frame
+        self.im = current.im
+        self._mode = current.mode
+        self._size = current.size
+
+    def tell(self) -> int:
+        return self._index
 
 class StickerConverter:
     TARGET_SIZE = 512
     MAX_DURATION_SEC = 15
     DEFAULT_FPS = 15
     DEFAULT_QUALITY = 80
+    # Pillow's own default for thumbnail(): reduce()/draft down to 2x the target, then resample
+    REDUCING_GAP = 2.0
+
+    # Encoder effort presets. Pillow's WebP `method` and FFmpeg libwebp's
+    # `compression_level` are the same libwebp knob (0 = fastest, 6 = smallest),
+    # so each preset sets both to the same level. Quality stays with `quality`.
+    # No preset keeps the historical settings (Pillow 6, FFmpeg 4).
+    PRESETS = {
+        'fast': {'method': 1, 'compression_level': 1},
+        'balanced': {'method': 4, 'compression_level': 4},
+        'small': {'method': 6, 'compression_level': 6},
+    }
+    LEGACY_ENCODER = {'method': 6, 'compression_level': 4}
+
+    # Animated encodings: 'auto' picks one of the others from the content
+    ENCODINGS = ('lossy', 'mixed', 'lossless', 'auto')
+    # Low-colour detection over the first few planned frames
+    PALETTE_SAMPLES = 3
+    PALETTE_MAX_COLORS = 256
+    # Share of pixels in the 16 most common colours
+    PALETTE_COVERAGE = 0.9
+    MIXED_COVERAGE = 0.6
+    # libwebp lossless effort (the `quality` of a lossless encode)
+    LOSSLESS_EFFORT = 25
+
+    # WhatsApp rejects stickers above these sizes
+    MAX_STATIC_BYTES = 100 * 1024
+    MAX_ANIMATED_BYTES = 500 * 1024
+    # Size-budget search bounds: lowest quality tried, fps steps, probe window
+    MIN_QUALITY = 10
+    FPS_LADDER = (15, 12, 10, 8)
+    PROBE_SECONDS = 2
+
+    def __init__(self, cache: Optional[StickerCache] = None, probe: Optional[MediaProbe] = None):
+        self.cache = cache
+        self.probe = probe or MediaProbe()
+        # (kind, size) -> executor, kept warm across requests
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    def _frame_pool(self, workers: int, kind: str = 'thread') -> Executor:
+        """Shared pool for per-frame resizing; Pillow releases the GIL while resampling"""
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown pool type: {kind}")
+        key = (kind, max(1, min(workers, MAX_WORKERS)))
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                if kind == 'process':
+                    pool = ProcessPoolExecutor(max_workers=key[1])
+                else:
+                    pool = ThreadPoolExecutor(max_workers=key[1], thread_name_prefix='sticker-frame')
+                self._pools[key] = pool
+        return pool
+
+    def _batch_pool(self, workers: int) -> Executor:
+        """
+        Item-level pool for createBatch. Separate from the frame pools so an
+        item waiting on its own frame workers can never starve them.
+        """
+        key = ('batch', max(1, min(workers, MAX_BATCH_CONCURRENCY)))
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=key[1], thread_name_prefix='sticker-batch')
+                self._pools[key] = pool
+        return pool
+
+    @classmethod
+    def _encoder_settings(cls, preset: Optional[str]) -> dict:
+        if preset is None:
+            return cls.LEGACY_ENCODER
+        if preset not in cls.PRESETS:
+            raise ValueError(f"Unknown preset: {preset} (expected one of {', '.join(cls.PRESETS)})")
+        return cls.PRESETS[preset]
     
+    @staticmethod
+    def _color_profile(frames: List[Image.Image]) -> dict:
+        """Distinct colours and the share of pixels in the 16 most common ones"""
+        counts = {}
+        for frame in frames:
+            # NEAREST keeps the source colours exact
+            thumb = frame.convert('RGBA').resize((128, 128), Image.Resampling.NEAREST)
+            for n, color in thumb.getcolors(128 * 128):
+                counts[color] = counts.get(color, 0) + n
+        top = sorted(counts.values(), reverse=True)[:16]
+        return {'colors': len(counts), 'coverage': round(sum(top) / sum(counts.values()), 3)}
+
+    @classmethod
+    def _choose_encoding(cls, profile: dict, allow_lossless: bool = True) -> str:
+        """
+        Flat, few-colour content -> palette lossless; mostly flat -> mixed
+        (libwebp picks lossy or lossless per frame); anything else -> lossy.
+        """
+        if profile['colors'] <= cls.PALETTE_MAX_COLORS and profile['coverage'] >= cls.PALETTE_COVERAGE:
+            return 'lossless' if allow_lossless else 'mixed'
+        if profile['coverage'] >= cls.MIXED_COVERAGE:
+            return 'mixed'
+        return 'lossy'
+
     @staticmethod
     def _random_hex(nbytes: int = 16) -> str:
         """Generate random hex string for pack ID"""
@@ -24,21 +704,40 @@ class StickerConverter:
     def _build_whatsapp_exif(
         pack_name: str = "",
         author_name: str = "",
-        emojis: List[str] = None
+        emojis: List[str] = None,
+        stable_id: bool = False
     ) -> bytes:
-        """Build WhatsApp EXIF metadata structure"""
-        if emojis is None:
-            emojis = []
-            
+        """
+        Build WhatsApp EXIF metadata structure.
+        With `stable_id` the pack id is derived from pack and author instead of
+        being random, so identical stickers stay byte-identical and the blob is
+        served from a memo after the first build.
+        """
+        emojis = tuple(emojis or ())
+        if stable_id:
+            return StickerConverter._stable_exif(pack_name, author_name, emojis)
+        pack_id = f"com.sticker.pack.{StickerConverter._random_hex(16)}"
+        return StickerConverter._exif_blob(pack_id, pack_name, author_name, emojis)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _stable_exif(pack_name: str, author_name: str, emojis: Tuple[str, ...]) -> bytes:
+        """Memoised EXIF blob with a pack id hashed from (pack, author)"""
+        identity = json.dumps([pack_name, author_name]).encode('utf-8')
+        pack_id = f"com.sticker.pack.{hashlib.sha256(identity).hexdigest()[:32]}"
+        return StickerConverter._exif_blob(pack_id, pack_name, author_name, emojis)
+
+    @staticmethod
+    def _exif_blob(pack_id: str, pack_name: str, author_name: str, emojis: Tuple[str, ...]) -> bytes:
         # WhatsApp compatible EXIF format
         metadata = {
-            "sticker-pack-id": f"com.sticker.pack.{StickerConverter._random_hex(16)}",
+            "sticker-pack-id": pack_id,
             "sticker-pack-name": pack_name,
             "sticker-pack-publisher": author_name,
         }
         
         if emojis:
-            metadata["emojis"] = emojis
+            metadata["emojis"] = list(emojis)
         
         json_data = json.dumps(metadata, separators=(',', ':')).encode('utf-8')
         
@@ -60,67 +759,125 @@ class StickerConverter:
         
         return bytes(tiff_header) + json_data
     
+    @staticmethod
+    def _bitstream_canvas(fourcc: bytes, payload: memoryview) -> Optional[Tuple[int, int, bool]]:
+        """(width, height, has_alpha) from a simple-format VP8/VP8L bitstream header"""
+        if fourcc == b'VP8 ' and len(payload) >= 10 and payload[3:6] == b'\x9d\x01\x2a':
+            width, height = struct.unpack_from('<HH', payload, 6)
+            return width & 0x3FFF, height & 0x3FFF, False
+        if fourcc == b'VP8L' and len(payload) >= 5 and payload[0] == 0x2F:
+            bits = struct.unpack_from('<I', payload, 1)[0]
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, bool((bits >> 28) & 1)
+        return None
+
     @staticmethod
     def _attach_exif_to_webp(webp_data: bytes, exif_data: bytes) -> bytes:
         """
         Attach EXIF metadata to WebP image (Pure Python In-Memory)
         Does not use external webpmux tool, performs direct byte manipulation.
+        Chunks are referenced through a memoryview and joined once, so the
+        untouched image data is copied exactly one time. EXIF goes after the
+        image data (before XMP) and the VP8X EXIF flag is set, adding a VP8X
+        chunk to simple-format files when needed.
         """
         if len(webp_data) < 12:
             raise ValueError("Invalid WebP data")
         
         if webp_data[:4] != b'RIFF' or webp_data[8:12] != b'WEBP':
             raise ValueError("Not a valid WebP file")
-        
-        chunks = []
+
+        view = memoryview(webp_data)
+        total = len(webp_data)
+        parts = []
+        has_vp8x = False
+        xmp_index = None
+        canvas = None
         pos = 12
         
         # Parse existing chunks
-        while pos < len(webp_data):
-            if pos + 8 > len(webp_data):
-                break
-                
-            chunk_fourcc = webp_data[pos:pos+4]
-            chunk_size = struct.unpack('<I', webp_data[pos+4:pos+8])[0]
-            chunk_data = webp_data[pos+8:pos+8+chunk_size]
-            
-            # Filter out existing EXIF to replace it
-            if chunk_fourcc != b'EXIF':
-                chunks.append((chunk_fourcc, chunk_data))
-            
-            pos += 8 + chunk_size
-            # Padding byte if odd size
-            if chunk_size % 2 == 1:
-                pos += 1
-        
-        # Insert EXIF chunk immediately after the VP8/VP8L/VP8X header
-        # Usually it's safe to put it as the second chunk (index 1) or first if list empty
-        insert_pos = 1 if len(chunks) > 0 else 0
-        chunks.insert(insert_pos, (b'EXIF', exif_data))
-        
-        # Reconstruct WebP
-        output = io.BytesIO()
-        output.write(b'RIFF')
-        
-        # Placeholder for file size (will be filled later)
-        output.write(b'\x00\x00\x00\x00') 
-        output.write(b'WEBP')
-        
-        for fourcc, data in chunks:
-            output.write(fourcc)
-            output.write(struct.pack('<I', len(data)))
-            output.write(data)
-            if len(data) % 2 == 1:
-                output.write(b'\x00') # Padding
-        
-        result = output.getvalue()
-        
-        # Update file size in RIFF header
-        file_size = len(result) - 8
-        result = result[:4] + struct.pack('<I', file_size) + result[8:]
-        
-        return result
+        while pos + 8 <= total:
+            chunk_fourcc = bytes(view[pos:pos+4])
+            chunk_size = struct.unpack_from('<I', view, pos + 4)[0]
+            body = pos + 8
+            end = body + chunk_size
+            next_pos = end + (chunk_size & 1)
+
+            if chunk_fourcc == b'VP8X':
+                has_vp8x = True
+                header = bytearray(view[pos:min(end, total)])
+                if len(header) > 8:
+                    header[8] |= 0x08  # EXIF flag
+                parts.append(header)
+            elif chunk_fourcc == b'EXIF':
+                # Filter out existing EXIF to replace it
+                pass
+            elif end > total:
+                # Truncated last chunk: keep what is there with a corrected size
+                payload = view[body:total]
+                parts.append(chunk_fourcc + struct.pack('<I', len(payload)))
+                parts.append(payload)
+                if len(payload) % 2 == 1:
+                    parts.append(b'\x00')
+            else:
+                if chunk_fourcc == b'XMP ' and xmp_index is None:
+                    xmp_index = len(parts)
+                if canvas is None and chunk_fourcc in (b'VP8 ', b'VP8L'):
+                    canvas = StickerConverter._bitstream_canvas(chunk_fourcc, view[body:end])
+                parts.append(view[pos:min(next_pos, total)])
+                if next_pos > total:
+                    parts.append(b'\x00')
+
+            pos = next_pos
+
+        exif_chunk = [b'EXIF', struct.pack('<I', len(exif_data)), exif_data]
+        if len(exif_data) % 2 == 1:
+            exif_chunk.append(b'\x00') # Padding
+        if xmp_index is None:
+            parts.extend(exif_chunk)
+        else:
+            parts[xmp_index:xmp_index] = exif_chunk
+
+        if not has_vp8x and canvas is not None:
+            # Simple format cannot carry metadata: promote it to extended format
+            width, height, has_alpha = canvas
+            flags = 0x08 | (0x10 if has_alpha else 0)
+            parts.insert(0, b'VP8X' + struct.pack('<I', 10) + bytes([flags, 0, 0, 0])
+                         + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little'))
+
+        file_size = 4 + sum(len(part) for part in parts)
+        return b''.join([b'RIFF', struct.pack('<I', file_size), b'WEBP', *parts])
     
+    @staticmethod
+    def _webp_animation_info(webp_data: bytes) -> dict:
+        """Canvas size, frame count, per-frame and total duration (ms) read from WebP chunk headers only"""
+        info = {'width': 0, 'height': 0, 'frames': 0, 'duration': 0, 'durations': [], 'animated': False}
+        pos = 12
+        while pos + 8 <= len(webp_data):
+            fourcc = webp_data[pos:pos+4]
+            chunk_size = struct.unpack('<I', webp_data[pos+4:pos+8])[0]
+            body = pos + 8
+
+            if fourcc == b'VP8X' and chunk_size >= 10:
+                info['animated'] = bool(webp_data[body] & 0x02)
+                info['width'] = 1 + int.from_bytes(webp_data[body+4:body+7], 'little')
+                info['height'] = 1 + int.from_bytes(webp_data[body+7:body+10], 'little')
+            elif fourcc == b'ANMF' and chunk_size >= 16:
+                duration = int.from_bytes(webp_data[body+12:body+15], 'little')
+                info['frames'] += 1
+                info['duration'] += duration
+                info['durations'].append(duration)
+            elif fourcc in (b'VP8 ', b'VP8L') and not info['width']:
+                # Simple format: no VP8X, the canvas is the bitstream size
+                canvas = StickerConverter._bitstream_canvas(fourcc, memoryview(webp_data)[body:body+chunk_size])
+                if canvas is not None:
+                    info['width'], info['height'] = canvas[0], canvas[1]
+
+            pos = body + chunk_size + (chunk_size & 1)
+
+        if not info['frames']:
+            info['frames'] = 1
+        return info
+
     @staticmethod
     def _resize_image(img: Image.Image, crop: bool = False) -> Image.Image:
         """Resize image to 512x512 handling transparency and aspect ratio"""
@@ -161,75 +918,306 @@ class StickerConverter:
         
         return img
 
+    @classmethod
+    def _resize_static(cls, img: Image.Image, crop: bool = False) -> Image.Image:
+        """
+        `_resize_image` for a single still image, doing only the work the input needs:
+        JPEGs are downscaled in the DCT domain while decoding (draft), large
+        images are box-reduced before LANCZOS, opaque images stay RGB/L, and
+        the padding canvas gets a plain paste instead of alpha compositing.
+        """
+        target = cls.TARGET_SIZE
+        w, h = img.size
+        scale = target / (min(w, h) if crop else max(w, h))
+
+        if img.format == 'JPEG' and scale < 1:
+            # Decoder picks 1/2, 1/4 or 1/8; keep REDUCING_GAP x the final size for LANCZOS
+            gap = cls.REDUCING_GAP
+            img.draft('RGB', (math.ceil(w * scale * gap), math.ceil(h * scale * gap)))
+            w, h = img.size
+            scale = target / (min(w, h) if crop else max(w, h))
+
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        if has_alpha:
+            img = img.convert('RGBA')
+            # Fully opaque alpha: resizing RGBA costs two extra premultiply passes
+            if img.getchannel('A').getextrema()[0] == 255:
+                img = img.convert('RGB')
+                has_alpha = False
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        if crop:
+            side = min(w, h)
+            left = (w - side) // 2
+            top = (h - side) // 2
+            box = (left, top, left + side, top + side)
+            size = (target, target)
+        else:
+            box = (0, 0, w, h)
+            size = (
+                max(1, min(target, int(w * scale))),
+                max(1, min(target, int(h * scale)))
+            )
+
+        if size != (w, h) or box != (0, 0, w, h):
+            img = img.resize(size, Image.Resampling.LANCZOS, box=box, reducing_gap=cls.REDUCING_GAP)
+
+        if size != (target, target):
+            # The canvas is empty, so a straight copy equals compositing
+            canvas = Image.new('RGBA', (target, target), (0, 0, 0, 0))
+            canvas.paste(img, ((target - size[0]) // 2, (target - size[1]) // 2))
+            img = canvas
+        elif not has_alpha and img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        return img
+
+    @staticmethod
+    def _run_ffmpeg(
+        cmd: List[str],
+        feed: Optional[Iterable] = None,
+        pass_fds: Tuple[int, ...] = (),
+        timeout: float = 60
+    ) -> bytes:
+        """
+        Run FFmpeg with stdin fed from `feed` (chunks) on a thread while stdout
+        is drained on this one, so neither side waits for the other to finish.
+        Only the tail of stderr is kept for error messages.
+        """
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if feed is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=pass_fds
+        )
+        stderr_tail = deque(maxlen=32)
+        timed_out = threading.Event()
+
+        def write_input():
+            try:
+                for chunk in feed:
+                    process.stdin.write(chunk)
+            except (BrokenPipeError, ValueError):
+                # FFmpeg stops reading early once -t is reached
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        def read_errors():
+            for line in process.stderr:
+                stderr_tail.append(line)
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        threads = [threading.Thread(target=read_errors, daemon=True)]
+        if feed is not None:
+            threads.append(threading.Thread(target=write_input, daemon=True))
+        for thread in threads:
+            thread.start()
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+
+        try:
+            output = []
+            for chunk in iter(lambda: process.stdout.read(65536), b''):
+                output.append(chunk)
+            process.wait()
+        finally:
+            timer.cancel()
+            for thread in threads:
+                thread.join()
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if process.returncode != 0:
+            error_log = b''.join(stderr_tail).decode('utf-8', errors='ignore')
+            raise ValueError(f"FFmpeg Error: {error_log}")
+        return b''.join(output)
+
+    @staticmethod
+    def _chunked(data: bytes, size: int = 65536) -> Iterable[memoryview]:
+        view = memoryview(data)
+        for pos in range(0, len(view), size):
+            yield view[pos:pos + size]
+
     def _process_video_with_ffmpeg(
         self,
-        video_bytes: bytes,
+        source: VideoSource,
         fps: int,
         max_duration: int,
         quality: int,
         crop: bool,
-        pack_name: str,
-        author_name: str,
-        emojis: List[str]
+        preset: Optional[str] = None,
+        start_time: float = 0
     ) -> bytes:
         """
         Process video using FFmpeg via PIPES (No temp files)
+        `source` is the video as bytes (streamed to stdin in chunks), a file
+        path FFmpeg reads itself, or an open file descriptor it inherits.
+        Seeking and the duration limit are input options, and frames are
+        decimated to `fps` before scaling, so only kept frames get scaled.
+        Returns WebP without EXIF.
         """
         target = self.TARGET_SIZE
+        encoder = self._encoder_settings(preset)
+
+        feed = None
+        pass_fds = ()
+        if isinstance(source, int):
+            input_arg = f'pipe:{source}'
+            pass_fds = (source,)
+        elif isinstance(source, str):
+            input_arg = f'file:{source}'
+        else:
+            input_arg = 'pipe:0'
+            feed = self._chunked(source)
         
-        # Setup Video Filter
+        # Setup Video Filter (fps first: dropped frames never reach the scaler)
         if crop:
-            vf = f"crop='min(iw,ih)':'min(iw,ih)',scale={target}:{target}:flags=lanczos,format=yuva420p"
+            vf = f"fps={fps},crop='min(iw,ih)':'min(iw,ih)',scale={target}:{target}:flags=lanczos,format=yuva420p"
         else:
-            vf = f"scale={target}:{target}:force_original_aspect_ratio=decrease,pad={target}:{target}:(ow-iw)/2:(oh-ih)/2:color=0x00000000,format=yuva420p"
+            vf = f"fps={fps},scale={target}:{target}:force_original_aspect_ratio=decrease,pad={target}:{target}:(ow-iw)/2:(oh-ih)/2:color=0x00000000,format=yuva420p"
             
         # FFmpeg command
-        # pipe:0 = stdin (input)
+        # pipe:0 = stdin (input), or a path / inherited fd
         # pipe:1 = stdout (output)
         cmd = [
             'ffmpeg',
             '-hide_banner', '-loglevel', 'error',
-            '-i', 'pipe:0', 
+            *(['-ss', f'{start_time:.3f}'] if start_time else []),
+            '-t', str(max_duration),
+            '-i', input_arg, 
             '-vf', vf,
             '-c:v', 'libwebp',
             '-lossless', '0',
-            '-compression_level', '4', # Balanced speed/size
+            '-compression_level', str(encoder['compression_level']),
             '-q:v', str(100 - quality),
             '-loop', '0',
             '-an', # Remove audio
             '-r', str(fps),
-            '-t', str(max_duration),
             '-f', 'webp', # Force format to webp for stdout
             'pipe:1'
         ]
         
         try:
-            # Run FFmpeg with piping
-            process = subprocess.run(
-                cmd,
-                input=video_bytes,
-                capture_output=True,
-                timeout=60
-            )
-            
-            if process.returncode != 0:
-                error_log = process.stderr.decode('utf-8', errors='ignore')
-                raise ValueError(f"FFmpeg Error: {error_log}")
-            
-            webp_data = process.stdout
+            with stage('ffmpeg') as record:
+                webp_data = self._run_ffmpeg(cmd, feed, pass_fds, timeout=60)
+                if record is not None and webp_data:
+                    record['frames'] += self._webp_animation_info(webp_data)['frames']
             
             if not webp_data:
                 raise ValueError("FFmpeg returned empty data")
-                
-            # Add EXIF directly to the bytes
-            exif_data = self._build_whatsapp_exif(pack_name, author_name, emojis)
-            return self._attach_exif_to_webp(webp_data, exif_data)
+
+            return webp_data
             
         except subprocess.TimeoutExpired:
             raise ValueError("Video conversion timed out")
         except Exception as e:
             raise ValueError(f"Video processing failed: {str(e)}")
 
+    @staticmethod
+    def _gif_frame_durations(data: bytes) -> Optional[List[int]]:
+        """
+        Read per-frame delays (ms) straight from GIF blocks, without decoding pixels.
+        Returns None when the data is not a GIF this walker understands.
+        """
+        if data[:3] != b'GIF' or len(data) < 13:
+            return None
+
+        durations = []
+        delay = 0
+        flags = data[10]
+        pos = 13
+        if flags & 0x80:
+            # Global color table
+            pos += 3 << ((flags & 0x07) + 1)
+
+        try:
+            while pos < len(data):
+                block = data[pos]
+                if block == 0x21:
+                    # Extension: pick the delay out of Graphic Control Extensions
+                    label = data[pos + 1]
+                    pos += 2
+                    if label == 0xF9 and data[pos] >= 4:
+                        delay = struct.unpack_from('<H', data, pos + 2)[0] * 10
+                    while data[pos]:
+                        pos += data[pos] + 1
+                    pos += 1
+                elif block == 0x2C:
+                    # Image descriptor, optional local color table, LZW sub-blocks
+                    flags = data[pos + 9]
+                    pos += 10
+                    if flags & 0x80:
+                        pos += 3 << ((flags & 0x07) + 1)
+                    pos += 1
+                    while data[pos]:
+                        pos += data[pos] + 1
+                    pos += 1
+                    durations.append(delay)
+                    delay = 0
+                elif block == 0x3B:
+                    break
+                else:
+                    return None
+        except IndexError:
+            # Truncated file: keep the frames that were complete
+            pass
+
+        return durations or None
+
+    @staticmethod
+    def _plan_frames(
+        durations: List[int],
+        fps: int,
+        max_duration: float,
+        start_time: float = 0
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Sample source frames onto the target fps grid using their own timings,
+        over the window [start_time, start_time + max_duration) in seconds.
+        Returns (source frame indices, output durations in ms). A source frame
+        that covers several grid ticks is emitted once with a longer duration.
+        """
+        step = 1000 / fps
+        begin = start_time * 1000
+        limit = begin + max_duration * 1000
+
+        starts = []
+        t = 0
+        for d in durations:
+            if t >= limit:
+                break
+            starts.append(t)
+            # Browsers show zero/tiny GIF delays at 100 ms
+            t += d if d > 10 else 100
+        total = min(t, limit)
+
+        indices = []
+        j = 0
+        k = 0
+        while begin + k * step < total:
+            tick = begin + k * step
+            while j + 1 < len(starts) and starts[j + 1] <= tick:
+                j += 1
+            if not indices or indices[-1] != j:
+                indices.append(j)
+            k += 1
+
+        # Each kept frame runs from its own source start (or the window start)
+        # to the next kept one
+        shown = [max(starts[i], begin) for i in indices]
+        ends = shown[1:] + [total]
+        out_durations = [max(1, round(end - at)) for at, end in zip(shown, ends)]
+        return indices, out_durations
+
     def _process_animated_image(
         self,
         img: Image.Image,
@@ -237,117 +1225,982 @@ class StickerConverter:
         max_duration: int,
         quality: int,
         crop: bool,
-        pack_name: str,
-        author_name: str,
-        emojis: List[str]
+        streaming: bool = True,
+        durations: Optional[List[int]] = None,
+        workers: int = 1,
+        pool: str = 'thread',
+        preset: Optional[str] = None,
+        start_time: float = 0,
+        encoding: str = 'lossy',
+        allow_lossless: bool = True,
+        info: Optional[dict] = None
     ) -> bytes:
-        """Process GIF/APNG via Pillow (In-Memory)"""
-        max_frames = fps * max_duration
-        duration_per_frame = int(1000 / fps)
-        
-        frames = []
-        for i in range(min(img.n_frames, max_frames)):
+        """
+        Process GIF/APNG via Pillow (In-Memory), returns WebP without EXIF.
+        Only the source frames that land on the target fps grid are converted,
+        resized and encoded, and each keeps its real on-screen time.
+        With `streaming`, frames are resized one by one as the encoder asks
+        for them instead of being collected into a list first.
+        With `workers` > 1, decoding stays sequential but resizing runs on a
+        pool a few frames ahead of the encoder, and results come back in order.
+        `encoding` 'lossless' quantises each resized frame to at most 256 colours
+        so libwebp can use its colour-indexing transform; 'auto' chooses from
+        the first few source frames (`allow_lossless=False` caps it at 'mixed').
+        """
+        if durations is None:
+            durations = []
+            with stage('decode'):
+                for i in range(img.n_frames):
+                    try:
+                        img.seek(i)
+                    except EOFError:
+                        break
+                    durations.append(img.info.get('duration') or 0)
+
+        indices, frame_durations = self._plan_frames(durations, fps, max_duration, start_time)
+        n_frames = len(indices)
+        if not n_frames:
+            raise ValueError("startTime is beyond the end of the animation")
+
+        if encoding not in self.ENCODINGS:
+            raise ValueError(f"Unknown encoding: {encoding} (expected one of {', '.join(self.ENCODINGS)})")
+        report = {'requested': encoding}
+        if encoding == 'auto':
+            with stage('detect'):
+                samples = []
+                for i in indices[:self.PALETTE_SAMPLES]:
+                    img.seek(i)
+                    samples.append(img.convert('RGBA'))
+                report['detected'] = self._color_profile(samples)
+                encoding = self._choose_encoding(report['detected'], allow_lossless)
+        report['mode'] = encoding
+        if info is not None:
+            info['encoding'] = report
+
+        if workers > 1:
+            executor = self._frame_pool(workers, pool)
+            window = workers * 2
+            futures = {}
+            submitted = 0
+            available = n_frames
+
+            def resize_frame(i: int) -> Image.Image:
+                nonlocal submitted, available
+                while submitted < min(available, i + window + 1):
+                    try:
+                        img.seek(indices[submitted])
+                    except EOFError:
+                        available = submitted
+                        break
+                    futures[submitted] = executor.submit(
+                        self._resize_image, img.convert('RGBA'), crop
+                    )
+                    submitted += 1
+                if i >= available:
+                    raise EOFError("No more frames")
+                return futures.pop(i).result()
+        else:
+            def resize_frame(i: int) -> Image.Image:
+                img.seek(indices[i])
+                return self._resize_image(img.convert('RGBA'), crop)
+
+        def render(i: int) -> Image.Image:
+            # Per frame, so no RSS sampling; the encode stage covers the peak
+            with stage('resize', rss=False):
+                frame = resize_frame(i)
+                if encoding == 'lossless':
+                    frame = frame.quantize(
+                        self.PALETTE_MAX_COLORS, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE
+                    ).convert('RGBA')
+                return frame
+
+        if encoding == 'lossless':
+            # Quality means effort for lossless
+            mode_options = {'lossless': True, 'quality': self.LOSSLESS_EFFORT}
+        else:
+            mode_options = {'quality': quality, 'allow_mixed': encoding == 'mixed'}
+
+        if streaming:
             try:
-                img.seek(i)
-                frame = img.convert('RGBA')
-                frame = self._resize_image(frame, crop)
-                frames.append(frame)
+                first = render(0)
             except EOFError:
-                break
-                
+                raise ValueError("No frames extracted")
+            append_images = [FrameStream(lambda i: render(i + 1), n_frames - 1)] if n_frames > 1 else []
+        else:
+            frames = []
+            for i in range(n_frames):
+                try:
+                    frames.append(render(i))
+                except EOFError:
+                    break
+
+            if not frames:
+                raise ValueError("No frames extracted")
+            first, append_images = frames[0], frames[1:]
+            frame_durations = frame_durations[:len(frames)]
+
         output = io.BytesIO()
-        exif_data = self._build_whatsapp_exif(pack_name, author_name, emojis)
-        
-        if not frames:
-            raise ValueError("No frames extracted")
-
-        frames[0].save(
-            output,
-            format='WEBP',
-            save_all=True,
-            append_images=frames[1:],
-            duration=duration_per_frame,
-            loop=0,
-            quality=quality,
-            method=6,
-            exif=exif_data
-        )
+        with stage('encode') as record:
+            first.save(
+                output,
+                format='WEBP',
+                save_all=True,
+                append_images=append_images,
+                duration=frame_durations,
+                loop=0,
+                method=self._encoder_settings(preset)['method'],
+                **mode_options
+            )
+            if record is not None:
+                record['frames'] += len(frame_durations)
         return output.getvalue()
 
+    def _ready_webp(
+        self,
+        input_data: Union[bytes, str],
+        fps: Optional[int],
+        max_duration: float,
+        start_time: float,
+        target_bytes=None,
+        overhead: int = 0
+    ) -> Optional[Tuple[bytes, dict]]:
+        """
+        WebP input that already is a valid sticker: 512x512 canvas, no longer
+        than `max_duration`, and within the byte budget when one is set.
+        WhatsApp has no frame rate limit, so frame density is only checked
+        when the caller asked for a specific `fps`. Returns (data, chunk info)
+        so only the metadata needs rewriting, or None when the input has to
+        be re-encoded.
+        """
+        if isinstance(input_data, str):
+            with open(input_data, 'rb') as f:
+                if f.read(12)[8:12] != b'WEBP':
+                    return None
+                f.seek(0)
+                input_data = f.read()
+        if input_data[:4] != b'RIFF' or input_data[8:12] != b'WEBP':
+            return None
+
+        meta = self._webp_animation_info(input_data)
+        if (meta['width'], meta['height']) != (self.TARGET_SIZE, self.TARGET_SIZE):
+            return None
+        if meta['animated']:
+            if start_time or meta['duration'] > max_duration * 1000:
+                return None
+            # More frames than the requested fps allows over its own playback
+            if fps and meta['frames'] - 1 > fps * meta['duration'] / 1000:
+                return None
+        if target_bytes:
+            if target_bytes is True or target_bytes == 'auto':
+                target_bytes = self.MAX_ANIMATED_BYTES if meta['animated'] else self.MAX_STATIC_BYTES
+            if len(input_data) + overhead > int(target_bytes):
+                return None
+        return input_data, meta
+
     def create_sticker(
         self,
-        input_data: bytes,
+        input_data: Union[bytes, str],
         crop: bool = False,
         quality: int = DEFAULT_QUALITY,
-        fps: int = DEFAULT_FPS,
+        fps: Optional[int] = None,
         max_duration: int = MAX_DURATION_SEC,
         pack_name: str = "",
         author_name: str = "",
-        emojis: List[str] = None
+        emojis: List[str] = None,
+        use_cache: bool = True,
+        streaming: bool = True,
+        workers: int = 1,
+        pool: str = 'thread',
+        preset: Optional[str] = None,
+        target_bytes=None,
+        start_time: float = 0,
+        end_time: Optional[float] = None,
+        stable_pack_id: bool = False,
+        encoding: str = 'lossy',
+        info: Optional[dict] = None
     ) -> bytes:
-        """Entry point for creation"""
-        
-        # Check if input looks like a video/gif container for FFmpeg
-        # (MP4, WebM, GIF)
-        is_ffmpeg_candidate = False
-        
-        # Basic magic bytes check
-        if len(input_data) > 12:
-            if input_data[:3] == b'GIF': 
-                # Use FFmpeg for GIF if PIL fails or for consistency, 
-                # but PIL is often faster for simple GIFs. 
-                # Let's try PIL first for GIFs, FFmpeg for videos.
-                is_ffmpeg_candidate = False 
-            elif (input_data[4:12] in [b'ftypmp42', b'ftypisom', b'ftypMSNV'] or 
-                  input_data[:4] == b'\x1a\x45\xdf\xa3'): # WebM/MKV
-                is_ffmpeg_candidate = True
-
-        if is_ffmpeg_candidate:
-            return self._process_video_with_ffmpeg(
-                input_data, fps, max_duration, quality, crop,
-                pack_name, author_name, emojis
+        """
+        Entry point for creation.
+        `input_data` is the media itself or a path to it; videos given by path
+        are read by FFmpeg directly and never loaded into Python.
+        Pixels come from the cache when possible; EXIF is always attached fresh,
+        so the same media under another pack name is still a hit.
+        A WebP that already meets the sticker constraints is kept as is
+        (quality is not applied) and only gets its metadata rewritten.
+        `fps` defaults to DEFAULT_FPS for encoding; only an explicit value
+        makes a denser WebP get re-encoded.
+        `info`, when given, is filled with details for the response.
+        """
+        # Reject unknown presets/encodings before the cache lookup and the FFmpeg fallback
+        self._encoder_settings(preset)
+        if encoding not in self.ENCODINGS:
+            raise ValueError(f"Unknown encoding: {encoding} (expected one of {', '.join(self.ENCODINGS)})")
+        start_time = max(0, start_time or 0)
+        workers = max(1, min(int(workers or 1), MAX_WORKERS))
+        if end_time is not None:
+            if end_time <= start_time:
+                raise ValueError("endTime must be after startTime")
+            max_duration = min(max_duration, end_time - start_time)
+        cache = self.cache if use_cache else None
+        with stage('exif'):
+            exif_data = self._build_whatsapp_exif(pack_name, author_name, emojis, stable_pack_id)
+
+        with stage('detect'):
+            ready = self._ready_webp(
+                input_data, fps, max_duration, start_time, target_bytes, len(exif_data) + 10
             )
+        fps = fps or self.DEFAULT_FPS
+        if ready is not None:
+            webp_data, meta = ready
+            if info is not None:
+                info['webp'] = {'passthrough': True, 'frames': meta['frames'], 'duration': meta['duration']}
+            with stage('exif'):
+                return self._attach_exif_to_webp(webp_data, exif_data)
 
-        # Try processing as Image (Static or Animated GIF/WebP) via PIL
-        try:
-            img = Image.open(io.BytesIO(input_data))
-            
-            if getattr(img, 'is_animated', False) and img.n_frames > 1:
-                return self._process_animated_image(
-                    img, fps, max_duration, quality, crop,
-                    pack_name, author_name, emojis
-                )
-            else:
-                # Static
-                img = self._resize_image(img, crop)
-                output = io.BytesIO()
-                exif_data = self._build_whatsapp_exif(pack_name, author_name, emojis)
-                img.save(
-                    output, 
-                    format='WEBP', 
-                    quality=quality, 
-                    method=6, 
-                    exif=exif_data,
-                    save_all=True
+        key = None
+        if cache is not None:
+            with stage('cache'):
+                key = cache.key(
+                    input_data, crop=crop, quality=quality, fps=fps, max_duration=max_duration,
+                    preset=preset, target_bytes=target_bytes, start_time=start_time,
+                    encoding=encoding
                 )
-                return output.getvalue()
-                
-        except Exception:
+                webp_data = cache.get(key)
+            if info is not None:
+                info['cache'] = {'hit': webp_data is not None, **cache.stats()}
+            if webp_data is not None:
+                with stage('exif'):
+                    return self._attach_exif_to_webp(webp_data, exif_data)
+
+        webp_data = self._encode_sticker(
+            input_data, crop, quality, fps, max_duration, streaming, workers, pool, preset,
+            start_time=start_time,
+            encoding=encoding,
+            target_bytes=target_bytes,
+            # EXIF chunk header + padding on top of the payload
+            overhead=len(exif_data) + 10,
+            info=info
+        )
+
+        if cache is not None:
+            with stage('cache'):
+                cache.put(key, webp_data)
+            if info is not None:
+                info['cache'].update(cache.stats())
+
+        with stage('exif'):
+            return self._attach_exif_to_webp(webp_data, exif_data)
+
+    def _media_encoder(
+        self,
+        input_data: Union[bytes, str],
+        crop: bool,
+        streaming: bool = True,
+        workers: int = 1,
+        pool: str = 'thread',
+        preset: Optional[str] = None,
+        start_time: float = 0,
+        info: Optional[dict] = None,
+        encoding: str = 'lossy',
+        allow_lossless: bool = True
+    ) -> Tuple[Callable[[int, int, float], bytes], bool, Optional[int]]:
+        """
+        Route `input_data` (bytes or a file path) to an engine once, based on
+        `self.probe`; the detection lands in `info['media']`.
+        Returns (encode(quality, fps, max_duration) -> WebP without EXIF,
+        whether the output is animated, source playback length after `start_time`
+        in ms or None if unknown).
+        """
+        source = input_data
+        with stage('detect'):
+            media = self.probe.detect(source)
+        if info is not None:
+            info['media'] = media
+
+        def ffmpeg(quality: int, fps: int, max_duration: float) -> bytes:
+            return self._process_video_with_ffmpeg(
+                source, fps, max_duration, quality, crop, preset, start_time
+            )
+
+        def fallback(quality: int, fps: int, max_duration: float) -> bytes:
             # If PIL failed, try FFmpeg as a last resort (fallback for robust handling)
+            self.probe.record_fallback()
+            if info is not None:
+                info['media']['fallback'] = True
             try:
-                return self._process_video_with_ffmpeg(
-                    input_data, fps, max_duration, quality, crop,
-                    pack_name, author_name, emojis
-                )
+                return ffmpeg(quality, fps, max_duration)
             except Exception as e:
                 raise ValueError(f"Could not convert media: {str(e)}")
 
-    def add_exif(self, webp_data: bytes, pack_name: str, author_name: str, emojis: List[str]) -> bytes:
-        exif = self._build_whatsapp_exif(pack_name, author_name, emojis)
-        return self._attach_exif_to_webp(webp_data, exif)
+        if media['engine'] == 'ffmpeg':
+            return ffmpeg, media['animated'], None
+
+        if isinstance(source, str):
+            # Images are small; only videos stay on disk
+            with stage('input'), open(source, 'rb') as f:
+                input_data = f.read()
+
+        # Try processing as Image (Static or Animated GIF/WebP) via PIL
+        try:
+            with stage('decode'):
+                img = Image.open(io.BytesIO(input_data))
+                animated = getattr(img, 'is_animated', False) and img.n_frames > 1
+        except Exception:
+            return fallback, True, None
+
+        if animated:
+            with stage('decode'):
+                if media['kind'] == 'webp-animated':
+                    # Pillow only fills in a WebP frame's duration once its pixels are decoded
+                    durations = self._webp_animation_info(input_data)['durations'] or None
+                else:
+                    durations = self._gif_frame_durations(input_data)
+            total_ms = None
+            if durations is not None:
+                total_ms = sum(d if d > 10 else 100 for d in durations)
+                # A request error, not a decode failure: don't let it reach the FFmpeg fallback
+                if start_time * 1000 >= total_ms:
+                    raise ValueError("startTime is beyond the end of the animation")
+                total_ms = total_ms - start_time * 1000
+
+            def encode(quality: int, fps: int, max_duration: float) -> bytes:
+                try:
+                    return self._process_animated_image(
+                        img, fps, max_duration, quality, crop, streaming,
+                        durations=durations,
+                        workers=workers,
+                        pool=pool,
+                        preset=preset,
+                        start_time=start_time,
+                        encoding=encoding,
+                        allow_lossless=allow_lossless,
+                        info=info
+                    )
+                except Exception:
+                    return fallback(quality, fps, max_duration)
+
+            return encode, True, total_ms
+
+        resized = []
+
+        def encode(quality: int, fps: int, max_duration: float) -> bytes:
+            # Static: resized once, however many qualities get tried
+            try:
+                if not resized:
+                    with stage('resize'):
+                        resized.append(self._resize_static(img, crop))
+                output = io.BytesIO()
+                with stage('encode') as record:
+                    resized[0].save(
+                        output, 
+                        format='WEBP', 
+                        quality=quality, 
+                        method=self._encoder_settings(preset)['method'], 
+                        save_all=True
+                    )
+                    if record is not None:
+                        record['frames'] += 1
+                return output.getvalue()
+            except Exception:
+                return fallback(quality, fps, max_duration)
+
+        return encode, False, None
+
+    def _encode_sticker(
+        self,
+        input_data: bytes,
+        crop: bool,
+        quality: int,
+        fps: int,
+        max_duration: int,
+        streaming: bool = True,
+        workers: int = 1,
+        pool: str = 'thread',
+        preset: Optional[str] = None,
+        start_time: float = 0,
+        encoding: str = 'lossy',
+        target_bytes=None,
+        overhead: int = 0,
+        info: Optional[dict] = None
+    ) -> bytes:
+        """
+        Convert any supported media to a sticker WebP without EXIF.
+        With `target_bytes` (a byte count, or True for WhatsApp's limits) the
+        quality/fps are searched so the final sticker fits the budget; 'auto'
+        encoding then never picks lossless, which ignores quality.
+        """
+        encode, animated, total_ms = self._media_encoder(
+            input_data, crop, streaming, workers, pool, preset, start_time, info,
+            encoding=encoding, allow_lossless=not target_bytes
+        )
+        if not target_bytes:
+            return encode(quality, fps, max_duration)
+
+        if target_bytes is True or target_bytes == 'auto':
+            target_bytes = self.MAX_ANIMATED_BYTES if animated else self.MAX_STATIC_BYTES
+        budget = int(target_bytes) - overhead
+        if animated and total_ms is None:
+            # FFmpeg routes don't know their length; without it the probe is
+            # scaled to the whole max_duration and short clips get overestimated
+            with stage('probe'):
+                duration = self.probe.duration_ms(input_data)
+            if duration is not None:
+                total_ms = max(0, duration - start_time * 1000)
+
+        webp_data, report = self._encode_within_budget(
+            encode, animated, total_ms, budget, quality, fps, max_duration
+        )
+        if info is not None:
+            info['budget'] = {'targetBytes': int(target_bytes), **report}
+        return webp_data
+
+    def _encode_within_budget(
+        self,
+        encode: Callable[[int, int, float], bytes],
+        animated: bool,
+        total_ms: Optional[int],
+        budget: int,
+        quality: int,
+        fps: int,
+        max_duration: float
+    ) -> Tuple[bytes, dict]:
+        """
+        Find the highest quality (then fps, for animations) that fits `budget`.
+        Animations are judged from a short probe encode of the first seconds,
+        scaled up to the full playback length; statics are cheap enough to
+        probe at full size. Only the final pick is encoded in full.
+        """
+        stats = {'encodes': 0, 'probes': 0}
+        results = {}
+
+        def run(q: int, f: int, seconds: int) -> bytes:
+            key = (q, f, seconds)
+            if key not in results:
+                results[key] = encode(q, f, seconds)
+                stats['encodes'] += 1
+            return results[key]
+
+        limit_ms = max_duration * 1000
+        if total_ms is not None and total_ms <= self.PROBE_SECONDS * 1000:
+            # The probe would cover the whole clip anyway
+            probe_seconds = max_duration
+        else:
+            probe_seconds = min(self.PROBE_SECONDS, max_duration)
+
+        def estimate(q: int, f: int) -> float:
+            if not animated:
+                return len(run(q, f, max_duration))
+            stats['probes'] += 1
+            data = run(q, f, probe_seconds)
+            probed_ms = self._webp_animation_info(data)['duration']
+            if probe_seconds == max_duration or probed_ms < probe_seconds * 1000 - 1000 / f:
+                # The whole clip fit inside the probe
+                return len(data)
+            full_ms = min(total_ms, limit_ms) if total_ms is not None else limit_ms
+            return len(data) * full_ms / max(1, probed_ms)
+
+        qualities = sorted(set(range(self.MIN_QUALITY, quality, 5)) | {quality}, reverse=True)
+        fps_steps = [fps]
+        if animated:
+            fps_steps += [step for step in self.FPS_LADDER if step < fps]
+
+        chosen = None
+        for f in fps_steps:
+            if estimate(qualities[0], f) <= budget:
+                chosen = (0, f)
+                break
+            if estimate(qualities[-1], f) > budget:
+                continue
+            # Binary search: qualities[lo] fits, qualities[hi] does not
+            lo, hi = len(qualities) - 1, 0
+            while lo - hi > 1:
+                mid = (lo + hi) // 2
+                if estimate(qualities[mid], f) <= budget:
+                    lo = mid
+                else:
+                    hi = mid
+            chosen = (lo, f)
+            break
+
+        if chosen is None:
+            chosen = (len(qualities) - 1, fps_steps[-1])
+
+        # Probes are estimates: step down until the real encode fits
+        q_index, f = chosen
+        webp_data = run(qualities[q_index], f, max_duration)
+        while len(webp_data) > budget:
+            if q_index + 2 < len(qualities):
+                q_index += 2
+            elif q_index + 1 < len(qualities):
+                q_index += 1
+            elif f != fps_steps[-1]:
+                f = fps_steps[fps_steps.index(f) + 1]
+            else:
+                break
+            webp_data = run(qualities[q_index], f, max_duration)
+
+        return webp_data, {
+            'quality': qualities[q_index],
+            'fps': f,
+            'bytes': len(webp_data),
+            'fits': len(webp_data) <= budget,
+            **stats,
+        }
+
+    @staticmethod
+    def _flatten(img: Image.Image, background: Tuple[int, int, int]) -> Image.Image:
+        """RGB copy of `img` with any transparency laid over `background`"""
+        if img.mode == 'RGB':
+            return img
+        rgba = img.convert('RGBA')
+        canvas = Image.new('RGB', rgba.size, background)
+        canvas.paste(rgba, mask=rgba.getchannel('A'))
+        return canvas
+
+    def to_image(
+        self,
+        webp_data: bytes,
+        fmt: str = 'png',
+        frame: int = 0,
+        quality: int = 90,
+        background: Tuple[int, int, int] = (255, 255, 255),
+        info: Optional[dict] = None
+    ) -> bytes:
+        """
+        One frame of a (possibly animated) WebP as PNG or JPEG.
+        Only the frames up to `frame` are decoded; JPEG gets transparency
+        flattened onto `background`.
+        """
+        fmt = fmt.lower()
+        if fmt not in ('png', 'jpeg', 'jpg'):
+            raise ValueError(f"Unsupported image format: {fmt}")
+
+        with stage('decode'):
+            img = Image.open(io.BytesIO(webp_data))
+            n_frames = getattr(img, 'n_frames', 1)
+            img.seek(max(0, min(frame, n_frames - 1)))
+            img.load()
+
+        output = io.BytesIO()
+        with stage('encode'):
+            if fmt == 'png':
+                img.save(output, format='PNG')
+            else:
+                self._flatten(img, background).save(output, format='JPEG', quality=quality)
+        if info is not None:
+            info.update({'format': 'png' if fmt == 'png' else 'jpeg', 'width': img.width,
+                         'height': img.height, 'frames': n_frames})
+        return output.getvalue()
+
+    def to_video(
+        self,
+        webp_data: bytes,
+        fps: int = 30,
+        crf: int = 23,
+        max_duration: float = MAX_DURATION_SEC,
+        background: Tuple[int, int, int] = (255, 255, 255),
+        info: Optional[dict] = None
+    ) -> bytes:
+        """
+        Animated WebP -> H.264 MP4, streamed: frames are decoded one at a time
+        on FFmpeg's feeder thread and written to its stdin as raw RGB on a
+        constant `fps` grid, so memory holds a single frame whatever the
+        length. The MP4 is fragmented because stdout cannot be seeked back to
+        write a moov box. Still images become a one-second clip.
+        """
+        meta = self._webp_animation_info(webp_data)
+        durations = meta['durations'] or [1000]
+        # Same rule as GIFs: zero/tiny delays play at 100 ms
+        durations = [d if d > 10 else 100 for d in durations]
+        starts = []
+        total = 0
+        for d in durations:
+            starts.append(total)
+            total += d
+        total = min(total, max_duration * 1000)
+        step = 1000 / fps
+        ticks = max(1, math.ceil(total / step))
+
+        img = Image.open(io.BytesIO(webp_data))
+        width, height = img.size
+
+        def frames() -> Iterable[bytes]:
+            loaded = -1
+            raw = b''
+            j = 0
+            for k in range(ticks):
+                tick = k * step
+                while j + 1 < len(starts) and starts[j + 1] <= tick:
+                    j += 1
+                if j != loaded:
+                    with stage('decode', rss=False):
+                        img.seek(j)
+                        raw = self._flatten(img, background).tobytes()
+                    loaded = j
+                yield raw
+
+        cmd = [
+            'ffmpeg',
+            '-hide_banner', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+            '-s', f'{width}x{height}', '-framerate', str(fps),
+            '-i', 'pipe:0',
+            # yuv420p needs even dimensions
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(crf),
+            '-pix_fmt', 'yuv420p',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-an',
+            '-f', 'mp4',
+            'pipe:1'
+        ]
+        try:
+            with stage('ffmpeg'):
+                video = self._run_ffmpeg(cmd, feed=frames(), timeout=120)
+        except subprocess.TimeoutExpired:
+            raise ValueError("Video conversion timed out")
+        except Exception as e:
+            raise ValueError(f"Video conversion failed: {str(e)}")
+        if not video:
+            raise ValueError("FFmpeg returned empty data")
+
+        if info is not None:
+            info.update({'frames': meta['frames'], 'outputFrames': ticks, 'fps': fps,
+                         'duration': round(ticks * step)})
+        return video
+
+    def add_exif(
+        self,
+        webp_data: bytes,
+        pack_name: str,
+        author_name: str,
+        emojis: List[str],
+        stable_pack_id: bool = False
+    ) -> bytes:
+        with stage('exif'):
+            exif = self._build_whatsapp_exif(pack_name, author_name, emojis, stable_pack_id)
+            return self._attach_exif_to_webp(webp_data, exif)
+
+def handle_request(
+    converter: StickerConverter,
+    request: dict,
+    input_data: Optional[bytes] = None,
+    profile_rss: bool = True
+) -> Tuple[bytes, dict]:
+    """
+    Run a single decoded request.
+    Returns the resulting WebP bytes plus any extra response fields.
+    `input_data` carries the raw media in binary mode, otherwise `input` is base64.
+    With `profile: true`, create/addExif also return per-stage timings under `profile`
+    (without `rss_kb` when `profile_rss` is False).
+    """
+    command = request.get('command')
+    if command not in COMMANDS:
+        raise ValueError(f"Unknown command: {command}")
+    if request.get('profile') and command in ('create', 'addExif'):
+        profiler = Profiler(rss=profile_rss)
+        with profiler.activate():
+            result, extra = handle_request(converter, {**request, 'profile': False}, input_data)
+        return result, {**extra, 'profile': profiler.report()}
+
+    if input_data is None and command != 'stats':
+        # `inputPath` lets the caller hand over a file instead of its bytes
+        with stage('input'):
+            input_data = request.get('inputPath') or base64.b64decode(request.get('input'))
+
+    if command == 'create':
+        opts = request.get('options', {})
+        info = {}
+
+        result = converter.create_sticker(
+            input_data,
+            crop=opts.get('crop', False),
+            quality=opts.get('quality', 80),
+            fps=opts.get('fps'),
+            max_duration=opts.get('maxDuration', 15),
+            pack_name=opts.get('packName', ''),
+            author_name=opts.get('authorName', ''),
+            emojis=opts.get('emojis', []),
+            use_cache=opts.get('cache', True),
+            streaming=opts.get('streaming', True),
+            workers=max(1, min(int(opts.get('workers') or 1), MAX_WORKERS)),
+            pool=opts.get('pool', 'thread'),
+            preset=opts.get('preset'),
+            target_bytes=opts.get('targetBytes'),
+            start_time=opts.get('startTime', 0),
+            end_time=opts.get('endTime'),
+            stable_pack_id=opts.get('stablePackId', False),
+            encoding=opts.get('encoding', 'lossy'),
+            info=info
+        )
+        return result, info
+
+    elif command == 'addExif':
+        meta = request.get('metadata', {})
+        if isinstance(input_data, str):
+            with stage('input'), open(input_data, 'rb') as f:
+                input_data = f.read()
+        result = converter.add_exif(
+            input_data,
+            pack_name=meta.get('packName', ''),
+            author_name=meta.get('authorName', ''),
+            emojis=meta.get('emojis', []),
+            stable_pack_id=meta.get('stablePackId', False)
+        )
+        return result, {}
+
+    elif command in ('toImage', 'toVideo'):
+        opts = request.get('options', {})
+        if isinstance(input_data, str):
+            with stage('input'), open(input_data, 'rb') as f:
+                input_data = f.read()
+        background = tuple(opts.get('background', (255, 255, 255)))
+        info = {}
+        if command == 'toImage':
+            result = converter.to_image(
+                input_data,
+                fmt=opts.get('format', 'png'),
+                frame=opts.get('frame', 0),
+                quality=opts.get('quality', 90),
+                background=background,
+                info=info
+            )
+        else:
+            result = converter.to_video(
+                input_data,
+                fps=opts.get('fps', 30),
+                crf=opts.get('crf', 23),
+                max_duration=opts.get('maxDuration', StickerConverter.MAX_DURATION_SEC),
+                background=background,
+                info=info
+            )
+        return result, info
+
+    elif command == 'stats':
+        stats = {'media': converter.probe.stats()}
+        if converter.cache is not None:
+            stats['cache'] = converter.cache.stats()
+        return b'', {'stats': stats}
+
+def batch_items(
+    request: dict,
+    input_data: Optional[bytes] = None
+) -> List[Tuple[dict, Optional[bytes]]]:
+    """
+    Split a createBatch request into single `create` requests.
+    Shared `options` (pack metadata, quality, ...) are overridden per item.
+    Items with `inputSize` take their media from `input_data` in order;
+    the others carry `inputPath` or base64 `input` like a plain create.
+    """
+    shared = request.get('options', {})
+    view = memoryview(input_data) if input_data is not None else None
+    offset = 0
+    items = []
+    for item in request.get('items') or []:
+        sub = {
+            'command': 'create',
+            'options': {**shared, **item.get('options', {})},
+            'inputPath': item.get('inputPath'),
+            'input': item.get('input'),
+            'profile': item.get('profile', request.get('profile')),
+        }
+        media = None
+        size = item.get('inputSize')
+        if size is not None:
+            if view is None or offset + size > len(view):
+                raise ValueError("Batch payload is shorter than its items")
+            media = bytes(view[offset:offset + size])
+            offset += size
+        items.append((sub, media))
+    return items
+
+def run_batch(
+    converter: StickerConverter,
+    request: dict,
+    input_data: Optional[bytes] = None
+) -> Iterator[Tuple[int, dict, Optional[bytes]]]:
+    """
+    Convert every item of a createBatch request on a bounded thread pool.
+    Yields (item index, response fields, WebP or None) as each item finishes;
+    a failing item gets `error` instead of failing the whole batch.
+    """
+    items = batch_items(request, input_data)
+    if not items:
+        return
+    # Not capped by len(items): the pool is cached per size, idle threads are never started
+    concurrency = max(1, min(int(request.get('concurrency') or BATCH_CONCURRENCY), MAX_BATCH_CONCURRENCY))
+    pool = converter._batch_pool(concurrency)
+
+    # Items running side by side would share (and reset) the process-wide peak RSS
+    futures = {
+        pool.submit(handle_request, converter, sub, media, concurrency == 1): index
+        for index, (sub, media) in enumerate(items)
+    }
+    for future in as_completed(futures):
+        index = futures[future]
+        try:
+            result, extra = future.result()
+            yield index, {'success': True, **extra}, result
+        except Exception as e:
+            yield index, {'success': False, 'error': str(e)}, None
+
+def _read_exact(stream, size: int) -> bytes:
+    """Read exactly `size` bytes, or return b'' on a clean EOF"""
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = stream.read(size - len(buf))
+        if not chunk:
+            if buf:
+                raise EOFError("Truncated frame")
+            return b''
+        buf += chunk
+    return bytes(buf)
+
+def read_frame(stream):
+    """
+    Read one length-prefixed JSON frame (4-byte big endian length + UTF-8 JSON).
+    A payload that is not a UTF-8 JSON object raises ValueError after the whole
+    frame was consumed, so the stream stays in sync for the next one.
+    """
+    header = _read_exact(stream, FRAME_HEADER.size)
+    if not header:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    payload = _read_exact(stream, length)
+    if len(payload) != length:
+        raise EOFError("Truncated frame")
+    message = json.loads(payload.decode('utf-8'))
+    if not isinstance(message, dict):
+        raise ValueError("Request must be a JSON object")
+    return message
+
+def write_frame(stream, message: dict, payload: Optional[bytes] = None) -> None:
+    """
+    Write one length-prefixed JSON frame and flush it.
+    With `payload`, its size goes into the header as `size` and the raw bytes follow the frame.
+    """
+    if payload is not None:
+        message['size'] = len(payload)
+    header = json.dumps(message).encode('utf-8')
+    stream.write(FRAME_HEADER.pack(len(header)))
+    stream.write(header)
+    if payload:
+        stream.write(payload)
+    stream.flush()
+
+class RequestError(ValueError):
+    """A request frame that was read but cannot be served; `request_id` is its `id` if known"""
+
+    def __init__(self, message: str, request_id=None):
+        super().__init__(message)
+        self.request_id = request_id
+
+def read_request(stream):
+    """
+    Read one request frame plus its raw media when the header has `inputSize`.
+    Returns (request, input_data) or None on EOF; input_data is None for base64 requests.
+    """
+    request = read_frame(stream)
+    if request is None:
+        return None
+
+    input_size = request.get('inputSize')
+    if input_size is None:
+        return request, None
+    if type(input_size) is not int or input_size < 0:
+        # How many payload bytes follow is unknown; assume none were sent
+        raise RequestError("inputSize must be a non-negative integer", request.get('id'))
+
+    input_data = _read_exact(stream, input_size)
+    if len(input_data) != input_size:
+        raise EOFError("Truncated input payload")
+    return request, input_data
+
+def respond_batch(converter: StickerConverter, request: dict, input_data: Optional[bytes], stream) -> None:
+    """
+    Answer a createBatch request with one frame per item, in completion order
+    (`index` says which item), then a closing frame with `done: true`.
+    """
+    binary = input_data is not None or request.get('binary', False)
+    total = failed = 0
+    try:
+        for index, response, result in run_batch(converter, request, input_data):
+            total += 1
+            failed += not response['success']
+            response['id'] = request.get('id')
+            response['index'] = index
+            if not binary and result is not None:
+                response['data'] = base64.b64encode(result).decode('utf-8')
+            write_frame(stream, response, result if binary else None)
+        done = {'success': True, 'done': True, 'total': total, 'failed': failed}
+    except Exception as e:
+        done = {'success': False, 'done': True, 'error': str(e)}
+
+    done['id'] = request.get('id')
+    write_frame(stream, done)
+
+def respond(converter: StickerConverter, request: dict, input_data: Optional[bytes], stream) -> None:
+    """Handle one framed request and write its framed response"""
+    if request.get('command') == 'createBatch':
+        respond_batch(converter, request, input_data, stream)
+        return
+
+    binary = input_data is not None or request.get('binary', False)
+    try:
+        result, extra = handle_request(converter, request, input_data)
+        response = {'success': True, **extra}
+        if not binary:
+            response['data'] = base64.b64encode(result).decode('utf-8')
+    except Exception as e:
+        result = None
+        response = {'success': False, 'error': str(e)}
+
+    response['id'] = request.get('id')
+    write_frame(stream, response, result if binary else None)
+
+def serve():
+    """
+    Long-lived worker mode: answer framed requests from stdin until EOF.
+    Every response carries the `id` of the request it belongs to.
+    Requests with `inputSize` (or `binary: true`) get a binary response:
+    a header with `size` followed by the raw WebP bytes.
+    createBatch answers with one frame per item, then a `done` frame.
+    """
+    converter = StickerConverter(cache=StickerCache.from_env(), probe=MediaProbe.from_env())
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+
+    while True:
+        try:
+            message = read_request(stdin)
+        except EOFError:
+            break
+        except ValueError as e:
+            # Bad frame (not UTF-8 JSON / not an object / bad inputSize): answer it, keep serving
+            write_frame(stdout, {'success': False, 'id': getattr(e, 'request_id', None), 'error': f"Invalid request: {e}"})
+            continue
+        if message is None:
+            break
+
+        request, input_data = message
+        respond(converter, request, input_data, stdout)
+
+def main_binary():
+    """One-shot binary mode: one framed request in, one framed response out"""
+    converter = StickerConverter(cache=StickerCache.from_env(), probe=MediaProbe.from_env())
+    try:
+        message = read_request(sys.stdin.buffer)
+    except (EOFError, ValueError) as e:
+        write_frame(sys.stdout.buffer, {'success': False, 'error': str(e)})
+        return
+    if message is None:
+        return
+
+    request, input_data = message
+    respond(converter, request, input_data, sys.stdout.buffer)
 
 def main():
-    converter = StickerConverter()
+    converter = StickerConverter(cache=StickerCache.from_env(), probe=MediaProbe.from_env())
     try:
         # Read from stdin
         input_line = sys.stdin.buffer.read()
@@ -355,37 +2208,26 @@ def main():
             return
 
         request = json.loads(input_line.decode('utf-8'))
-        command = request.get('command')
-        
-        if command == 'create':
-            input_data = base64.b64decode(request.get('input'))
-            opts = request.get('options', {})
-            
-            result = converter.create_sticker(
-                input_data,
-                crop=opts.get('crop', False),
-                quality=opts.get('quality', 80),
-                fps=opts.get('fps', 15),
-                max_duration=opts.get('maxDuration', 15),
-                pack_name=opts.get('packName', ''),
-                author_name=opts.get('authorName', ''),
-                emojis=opts.get('emojis', [])
-            )
-            print(json.dumps({'success': True, 'data': base64.b64encode(result).decode('utf-8')}))
-            
-        elif command == 'addExif':
-            webp_data = base64.b64decode(request.get('input'))
-            meta = request.get('metadata', {})
-            result = converter.add_exif(
-                webp_data,
-                pack_name=meta.get('packName', ''),
-                author_name=meta.get('authorName', ''),
-                emojis=meta.get('emojis', [])
-            )
-            print(json.dumps({'success': True, 'data': base64.b64encode(result).decode('utf-8')}))
-            
+        if request.get('command') == 'createBatch':
+            results = []
+            for index, response, result in run_batch(converter, request):
+                if result is not None:
+                    response['data'] = base64.b64encode(result).decode('utf-8')
+                results.append({'index': index, **response})
+            results.sort(key=lambda r: r['index'])
+            print(json.dumps({'success': True, 'results': results}))
+            return
+
+        result, extra = handle_request(converter, request)
+        print(json.dumps({'success': True, **extra, 'data': base64.b64encode(result).decode('utf-8')}))
+
     except Exception as e:
         print(json.dumps({'success': False, 'error': str(e)}))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if '--serve' in sys.argv[1:]:
+        serve()
+    elif '--binary' in sys.argv[1:]:
+        main_binary()
+    else:
+        main()
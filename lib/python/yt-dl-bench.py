@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for yt-dl.py against a local fake extractor (no network)
+
+Usage:
+    python3 yt-dl-bench.py serve [--requests N] [--extract-ms N]
+    python3 yt-dl-bench.py cache [--extract-ms N]
+    python3 yt-dl-bench.py files [--concurrent N] [--extract-ms N]
+    python3 yt-dl-bench.py batch [--items N] [--extract-ms N]
+"""
+import argparse
+import functools
+import http.server
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+YTDL_SCRIPT = os.path.join(HERE, 'yt-dl.py')
+
+# Runs yt-dl.py as __main__ with a `fake://<id>` extractor (also matching
+# https://fake.invalid/<id>, for commands that treat anything else as a search)
+# registered ahead of the built-in ones, so every command path (import,
+# YoutubeDL setup, format selection, JSON) is real except the remote extraction.
+# YTDL_BENCH_EXTRACT_MS simulates the remote round trip; with
+# YTDL_BENCH_MEDIA_URL the formats point at a local server (see media_server)
+# so downloads work too.
+FAKE_WRAPPER = """
+import os, runpy, sys, time
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+
+class FakeIE(InfoExtractor):
+    IE_NAME = 'fake'
+    _VALID_URL = r'(?:fake://|https?://fake\\.invalid/)(?P<id>[\\w-]+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        time.sleep(int(os.environ.get('YTDL_BENCH_EXTRACT_MS') or 0) / 1000)
+        base = os.environ.get('YTDL_BENCH_MEDIA_URL') or 'https://example.invalid/' + video_id
+        return {
+            'id': video_id,
+            'title': 'Fake ' + video_id,
+            'uploader': 'bench',
+            'duration': 212,
+            'view_count': 1000,
+            'upload_date': '20240101',
+            'thumbnail': 'https://example.invalid/%s.jpg' % video_id,
+            'description': '',
+            'formats': [{
+                'format_id': '%dp' % height,
+                'url': '%s/%d.mp4' % (base, height),
+                'ext': 'mp4',
+                'height': height,
+                'width': height * 16 // 9,
+                'vcodec': 'avc1.64001f',
+                'acodec': 'mp4a.40.2',
+                'filesize': height * 10000,
+            } for height in (360, 720, 1080)] + [{
+                'format_id': 'audio-' + acodec,
+                'url': '%s/audio.%s' % (base, ext),
+                'ext': ext,
+                'vcodec': 'none',
+                'acodec': acodec,
+                'abr': abr,
+            } for ext, acodec, abr in (('m4a', 'mp4a.40.2', 128), ('webm', 'opus', 130))],
+        }
+
+ydl_module = sys.modules['yt_dlp.YoutubeDL']
+builtin_classes = ydl_module.gen_extractor_classes
+builtin_lookup = ydl_module.get_info_extractor
+ydl_module.gen_extractor_classes = lambda: [FakeIE, *builtin_classes()]
+ydl_module.get_info_extractor = lambda key: FakeIE if key == FakeIE.ie_key() else builtin_lookup(key)
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+
+def ytdl_command(*args: str) -> List[str]:
+    return [sys.executable, '-c', FAKE_WRAPPER, YTDL_SCRIPT, *args]
+
+
+def bench_env(extract_ms: int, **extra: str) -> dict:
+    return {**os.environ, 'YTDL_BENCH_EXTRACT_MS': str(extract_ms), **extra}
+
+
+def make_media(directory: str, seconds: int = 2) -> None:
+    """
+    Tiny H.264/AAC MP4s named after the fake formats (360.mp4, 720.mp4, 1080.mp4)
+    plus the audio-only streams (audio.m4a AAC, audio.webm Opus)
+    """
+    ffmpeg = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y']
+    sine = ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}']
+    for height in (360, 720, 1080):
+        cmd = [
+            *ffmpeg,
+            '-f', 'lavfi', '-i', f'testsrc2=size=160x90:rate=15:duration={seconds}',
+            *sine,
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest',
+            os.path.join(directory, f'{height}.mp4')
+        ]
+        subprocess.run(cmd, capture_output=True, check=True)
+    for name, codec in (('audio.m4a', ['-c:a', 'aac', '-b:a', '128k']), ('audio.webm', ['-c:a', 'libopus', '-b:a', '128k'])):
+        subprocess.run([*ffmpeg, *sine, *codec, os.path.join(directory, name)], capture_output=True, check=True)
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def media_server(directory: str):
+    """Serve `directory` on a free localhost port; returns (server, base_url)"""
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+class Daemon:
+    """A `yt-dl.py --serve` process with the fake extractor, called one request at a time"""
+
+    def __init__(self, env: dict):
+        self.proc = subprocess.Popen(
+            ytdl_command('--serve'), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            env=env, text=True, encoding='utf-8'
+        )
+        self.next_id = 0
+
+    def call(self, command: str, *args: str) -> dict:
+        self.next_id += 1
+        self.proc.stdin.write(json.dumps({'id': self.next_id, 'command': command, 'args': list(args)}) + '\n')
+        self.proc.stdin.flush()
+        response = json.loads(self.proc.stdout.readline())
+        result = response['result']
+        if response['id'] != self.next_id or (isinstance(result, dict) and 'error' in result):
+            raise RuntimeError(response)
+        return result
+
+    def call_many(self, requests: List[tuple]) -> List[dict]:
+        """Send every (command, *args) at once; results in request order"""
+        first = self.next_id + 1
+        for command, *args in requests:
+            self.next_id += 1
+            self.proc.stdin.write(json.dumps({'id': self.next_id, 'command': command, 'args': args}) + '\n')
+        self.proc.stdin.flush()
+        results = {}
+        while len(results) < len(requests):
+            response = json.loads(self.proc.stdout.readline())
+            if isinstance(response['result'], dict) and 'error' in response['result']:
+                raise RuntimeError(response)
+            results[response['id']] = response['result']
+        return [results[first + i] for i in range(len(requests))]
+
+    def batch(self, spec: dict) -> Tuple[List[float], dict]:
+        """Run one batch request; seconds until each item's line arrived, and the summary"""
+        self.next_id += 1
+        start = time.perf_counter()
+        self.proc.stdin.write(json.dumps({'id': self.next_id, 'command': 'batch', **spec}) + '\n')
+        self.proc.stdin.flush()
+        arrivals = []
+        while True:
+            response = json.loads(self.proc.stdout.readline())
+            if response.get('done'):
+                return arrivals, response['result']
+            if 'error' in response['result']:
+                raise RuntimeError(response)
+            arrivals.append(time.perf_counter() - start)
+
+    def timed(self, command: str, *args: str) -> float:
+        start = time.perf_counter()
+        self.call(command, *args)
+        return time.perf_counter() - start
+
+    def close(self) -> None:
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def latency_stats(latencies: List[float]) -> dict:
+    return {
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 1),
+    }
+
+
+def bench_oneshot(requests: int, extract_ms: int) -> List[float]:
+    """One `python3 yt-dl.py info` process per request, like the old scraper"""
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        out = subprocess.run(
+            ytdl_command('info', f'fake://v{i}'), capture_output=True, check=True, env=bench_env(extract_ms)
+        ).stdout
+        latencies.append(time.perf_counter() - start)
+        if 'error' in json.loads(out):
+            raise RuntimeError(out)
+    return latencies
+
+
+def bench_serve(requests: int, extract_ms: int) -> dict:
+    """One --serve daemon: time to the first answer, then sequential steady-state requests"""
+    start = time.perf_counter()
+    # Distinct URLs, so the info cache never answers
+    daemon = Daemon(bench_env(extract_ms, YTDL_CACHE_TTL='0'))
+    try:
+        daemon.call('info', 'fake://warmup')
+        first = time.perf_counter() - start
+        latencies = [daemon.timed('info', f'fake://v{i}') for i in range(requests)]
+    finally:
+        daemon.close()
+    return {'first': first, 'latencies': latencies}
+
+
+def cmd_serve(args) -> dict:
+    oneshot = bench_oneshot(args.requests, args.extract_ms)
+    serve = bench_serve(args.requests, args.extract_ms)
+    return {
+        'requests': args.requests,
+        'extract_ms': args.extract_ms,
+        'oneshot': latency_stats(oneshot),
+        'serve_startup_ms': round(serve['first'] * 1000, 1),
+        'serve_steady': latency_stats(serve['latencies']),
+        'speedup_p50': round(percentile(oneshot, 50) / percentile(serve['latencies'], 50), 1),
+    }
+
+
+def cmd_cache(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix='ytdl-bench-')
+    media_dir = os.path.join(workdir, 'media')
+    os.makedirs(media_dir)
+    make_media(media_dir)
+    server, base = media_server(media_dir)
+    cache_file = os.path.join(workdir, 'cache.json')
+    env = bench_env(args.extract_ms, YTDL_BENCH_MEDIA_URL=base, YTDL_CACHE_FILE=cache_file)
+    out = os.path.join(workdir, 'out')
+
+    def ms(seconds: float) -> float:
+        return round(seconds * 1000, 1)
+
+    try:
+        daemon = Daemon(env)
+        try:
+            daemon.call('info', 'fake://warmup')
+            report = {
+                'info_miss_ms': ms(daemon.timed('info', 'fake://a')),
+                'info_hit_ms': ms(daemon.timed('info', 'fake://a')),
+                # Same link as the info call: the extracted info_dict is reused
+                'video_after_info_ms': ms(daemon.timed('video', 'fake://a', '720', out)),
+                'video_cold_ms': ms(daemon.timed('video', 'fake://b', '720', out)),
+            }
+        finally:
+            daemon.close()
+
+        # A new process only has the backing file
+        daemon = Daemon(env)
+        try:
+            daemon.call('info', 'fake://warmup')
+            report['info_after_restart_ms'] = ms(daemon.timed('info', 'fake://a'))
+            report['stats'] = daemon.call('stats')['cache']
+        finally:
+            daemon.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'extract_ms': args.extract_ms, **report}
+
+
+def cmd_files(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix='ytdl-bench-')
+    media_dir = os.path.join(workdir, 'media')
+    os.makedirs(media_dir)
+    make_media(media_dir)
+    server, base = media_server(media_dir)
+    out = os.path.join(workdir, 'out')
+    # Distinct requests for one item, each with its own output dir like separate chats
+    requests = [('audio', 'https://fake.invalid/song', '128', os.path.join(out, str(i))) for i in range(args.concurrent)]
+
+    def run(env: dict) -> dict:
+        daemon = Daemon(env)
+        try:
+            daemon.call('info', 'fake://warmup')
+            start = time.perf_counter()
+            first = daemon.call_many(requests)
+            first_s = time.perf_counter() - start
+            start = time.perf_counter()
+            again = daemon.call_many(requests)
+            again_s = time.perf_counter() - start
+        finally:
+            daemon.close()
+        return {
+            'first_round_ms': round(first_s * 1000, 1),
+            'second_round_ms': round(again_s * 1000, 1),
+            # Any result not served from the file cache ran its own download + MP3 transcode
+            'downloads': sum(not r.get('cached') for r in first + again),
+            'distinct_outputs': len({r['file_path'] for r in first}),
+        }
+
+    try:
+        common = dict(YTDL_BENCH_MEDIA_URL=base, YTDL_WORKERS=str(args.concurrent))
+        report = {
+            'uncached': run(bench_env(args.extract_ms, **common)),
+            'cached': run(bench_env(args.extract_ms, YTDL_FILE_CACHE_DIR=os.path.join(workdir, 'files'), **common)),
+        }
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'concurrent': args.concurrent, 'extract_ms': args.extract_ms, **report}
+
+
+def cmd_batch(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix='ytdl-bench-')
+    media_dir = os.path.join(workdir, 'media')
+    os.makedirs(media_dir)
+    make_media(media_dir)
+    server, base = media_server(media_dir)
+    out = os.path.join(workdir, 'out')
+    urls = [f'https://fake.invalid/item{i}' for i in range(args.items)]
+    env = bench_env(args.extract_ms, YTDL_BENCH_MEDIA_URL=base, YTDL_CACHE_TTL='0')
+
+    def ms(seconds: float) -> float:
+        return round(seconds * 1000, 1)
+
+    try:
+        daemon = Daemon(env)
+        try:
+            daemon.call('info', 'fake://warmup')
+            # One request per item, one after another (the old "download these 5 songs")
+            serial = []
+            start = time.perf_counter()
+            for url in urls:
+                daemon.call('audio', url, '128', os.path.join(out, 'serial'))
+                serial.append(time.perf_counter() - start)
+            rows = [{'mode': 'serial', 'first_ms': ms(serial[0]), 'total_ms': ms(serial[-1])}]
+
+            for network, transcode in ((args.items, 1), (3, 1), (3, 2)):
+                items = [{'type': 'audio', 'url': url, 'bitrate': '128'} for url in urls]
+                output = os.path.join(out, f'{network}-{transcode}')
+                arrivals, summary = daemon.batch(
+                    {'items': items, 'network': network, 'transcode': transcode, 'output': output}
+                )
+                rows.append({
+                    'mode': f'batch network={network} transcode={transcode}',
+                    'first_ms': ms(arrivals[0]),
+                    'total_ms': ms(arrivals[-1]),
+                    'failed': summary['failed'],
+                })
+        finally:
+            daemon.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'items': args.items, 'extract_ms': args.extract_ms, 'cpus': os.cpu_count(), 'rows': rows}
+
+
+def cmd_remux(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix='ytdl-bench-')
+    media_dir = os.path.join(workdir, 'media')
+    os.makedirs(media_dir)
+    make_media(media_dir, seconds=args.seconds)
+    server, base = media_server(media_dir)
+    out = os.path.join(workdir, 'out')
+    env = bench_env(0, YTDL_BENCH_MEDIA_URL=base, YTDL_CACHE_TTL='0')
+
+    rows = []
+    try:
+        daemon = Daemon(env)
+        try:
+            daemon.call('info', 'fake://warmup')
+            for accept in args.accept:
+                samples, result = [], None
+                for i in range(args.runs):
+                    # Fresh id per run so neither cache short-circuits the download
+                    url = f'https://fake.invalid/{accept.replace(",", "-")}-{i}'
+                    start = time.perf_counter()
+                    result = daemon.call('audio', url, '128', os.path.join(out, accept), accept)
+                    samples.append(time.perf_counter() - start)
+                rows.append({
+                    'accept': accept,
+                    'format': result['format'],
+                    'transcoded': result['transcoded'],
+                    'transcode_ms': result['transcode_ms'],
+                    'size_kb': round(os.path.getsize(result['file_path']) / 1024, 1),
+                    **latency_stats(samples),
+                })
+        finally:
+            daemon.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'seconds': args.seconds, 'runs': args.runs, 'cpus': os.cpu_count(), 'rows': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='yt-dl.py benchmarks')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('serve', help='one-shot process per command vs --serve daemon (startup and steady state)')
+    p.add_argument('--requests', type=int, default=20)
+    p.add_argument('--extract-ms', type=int, default=0, help='simulated remote extraction time')
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser('cache', help='info/search cache: miss vs hit, info_dict reuse for video, restart')
+    p.add_argument('--extract-ms', type=int, default=300, help='simulated remote extraction time')
+    p.set_defaults(func=cmd_cache)
+
+    p = sub.add_parser('files', help='N concurrent audio requests for one item, with and without the file cache')
+    p.add_argument('--concurrent', type=int, default=4)
+    p.add_argument('--extract-ms', type=int, default=300, help='simulated remote extraction time')
+    p.set_defaults(func=cmd_files)
+
+    p = sub.add_parser('batch', help='N audio items: serial requests vs one batch at several network/transcode limits')
+    p.add_argument('--items', type=int, default=5)
+    p.add_argument('--extract-ms', type=int, default=500, help='simulated remote extraction time')
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser('remux', help='audio per accepted format list: MP3 transcode vs m4a/opus remux')
+    p.add_argument('--seconds', type=int, default=180, help='length of the source audio')
+    p.add_argument('--runs', type=int, default=3)
+    p.add_argument('--accept', nargs='+', default=['mp3', 'm4a,mp3', 'opus,mp3'])
+    p.set_defaults(func=cmd_remux)
+
+    args = parser.parse_args()
+    print(json.dumps(args.func(args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
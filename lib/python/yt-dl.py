@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
 import sys
 import json
+import copy
+import fcntl
+import hashlib
+import time
+import zlib
 import yt_dlp
+from yt_dlp.dependencies import mutagen
 import os
 import re
 import urllib.request
 from pathlib import Path
 import io
 import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 
 # Fix encoding output untuk karakter Unicode/Emoji di judul lagu
 if sys.stdout.encoding != 'utf-8':
@@ -16,17 +27,28 @@ if sys.stdout.encoding != 'utf-8':
 # --- UTILS ---
 
 class SuppressOutput:
+    # Di mode --serve beberapa thread berbagi sys.stdout:
+    # thread pertama yang masuk menukar stream, yang terakhir keluar mengembalikannya
+    _lock = threading.Lock()
+    _depth = 0
+    _original = None
+
     def __enter__(self):
-        self._original_stdout = sys.stdout
-        self._original_stderr = sys.stderr
-        sys.stdout = io.StringIO()
-        sys.stderr = io.StringIO()
+        with SuppressOutput._lock:
+            if SuppressOutput._depth == 0:
+                SuppressOutput._original = (sys.stdout, sys.stderr)
+                sys.stdout = io.StringIO()
+                sys.stderr = io.StringIO()
+            SuppressOutput._depth += 1
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        sys.stdout = self._original_stdout
-        sys.stderr = self._original_stderr
+        with SuppressOutput._lock:
+            SuppressOutput._depth -= 1
+            if SuppressOutput._depth == 0:
+                sys.stdout, sys.stderr = SuppressOutput._original
 
+@lru_cache(maxsize=None)
 def find_js_runtime():
     runtimes = ['bun', 'node']
     for runtime in runtimes:
@@ -57,6 +79,591 @@ def get_base_opts():
 
     return opts
 
+class Stages:
+    """
+    Batas konkurensi per tahap: jaringan (ekstraksi + download) dan FFmpeg
+    (setiap postprocessor yt-dlp: ekstrak audio, merge, metadata, thumbnail).
+    Semua instance YDL_POOL menjalankan postprocessor lewat `wrap`, dengan
+    batas global YTDL_FFMPEG_JOBS (default jumlah CPU). Item batch memegang
+    slot jaringan sampai postprocessor pertamanya mulai, lalu pindah ke slot
+    FFmpeg batch-nya, jadi download berikutnya bisa jalan selama item ini
+    di-transcode.
+    """
+
+    def __init__(self, transcode_jobs):
+        self.transcode = threading.BoundedSemaphore(transcode_jobs)
+        self._local = threading.local()
+
+    @contextmanager
+    def record(self):
+        """Catat (nama postprocessor, detik) yang jalan di thread ini selama blok"""
+        timings = []
+        self._local.timings = timings
+        try:
+            yield timings
+        finally:
+            self._local.timings = None
+
+    @classmethod
+    def from_env(cls):
+        jobs = os.environ.get('YTDL_FFMPEG_JOBS')
+        return cls(max(1, int(jobs) if jobs else os.cpu_count() or 1))
+
+    @contextmanager
+    def limit(self, network, transcode=None):
+        """Jalankan satu item dengan semaphore `network` dan `transcode` (None = global)"""
+        network.acquire()
+        self._local.network = network
+        self._local.transcode = transcode
+        try:
+            yield
+        finally:
+            self._leave_network()
+            self._local.transcode = None
+
+    def _leave_network(self):
+        network = getattr(self._local, 'network', None)
+        if network is not None:
+            self._local.network = None
+            network.release()
+
+    def wrap(self, run_pp):
+        """Bungkus YoutubeDL.run_pp supaya setiap postprocessor memakai slot FFmpeg"""
+        @wraps(run_pp)
+        def gated(*args, **kwargs):
+            # Postprocessor bisa memanggil run_pp lagi; slot cukup diambil sekali
+            if getattr(self._local, 'in_pp', False):
+                return run_pp(*args, **kwargs)
+            self._leave_network()
+            with getattr(self._local, 'transcode', None) or self.transcode:
+                self._local.in_pp = True
+                start = time.perf_counter()
+                try:
+                    return run_pp(*args, **kwargs)
+                finally:
+                    self._local.in_pp = False
+                    timings = getattr(self._local, 'timings', None)
+                    if timings is not None:
+                        timings.append((args[0].pp_key(), time.perf_counter() - start))
+        return gated
+
+STAGES = Stages.from_env()
+
+class YDLPool:
+    """
+    Instance YoutubeDL yang tetap hangat per profil opsi (JSON dari opts).
+    Satu instance melayani satu panggilan sekaligus; setelah itu kembali ke
+    profilnya supaya panggilan berikut dengan opts yang sama tidak membangun ulang.
+    """
+    MAX_PROFILES = 16
+    MAX_IDLE = 2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = OrderedDict()
+
+    @staticmethod
+    def profile_key(opts):
+        return json.dumps(opts, sort_keys=True, default=str)
+
+    @contextmanager
+    def acquire(self, opts):
+        key = self.profile_key(opts)
+        ydl = None
+        with self._lock:
+            if key in self._idle:
+                self._idle.move_to_end(key)
+                if self._idle[key]:
+                    ydl = self._idle[key].pop()
+
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(opts)
+            ydl.run_pp = STAGES.wrap(ydl.run_pp)
+        try:
+            yield ydl
+        except BaseException:
+            # Kondisi setelah ekstraksi gagal tidak jelas, jangan dipakai ulang
+            ydl.close()
+            raise
+        self._release(key, ydl)
+
+    def _release(self, key, ydl):
+        evicted = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(idle) < self.MAX_IDLE:
+                idle.append(ydl)
+            else:
+                evicted.append(ydl)
+            while len(self._idle) > self.MAX_PROFILES:
+                evicted.extend(self._idle.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+
+    def close(self):
+        """Tutup semua instance idle (sekalian menulis balik file cookie)"""
+        with self._lock:
+            idle = [ydl for instances in self._idle.values() for ydl in instances]
+            self._idle.clear()
+        for ydl in idle:
+            ydl.close()
+
+YDL_POOL = YDLPool()
+
+class InfoCache:
+    """
+    Cache TTL + LRU untuk hasil `info` dan `search`, dengan key ID video
+    (dari URL YouTube bentuk apa pun) atau query + max_results. Bisa disimpan
+    ke file JSON supaya tetap ada setelah restart (YTDL_CACHE_FILE).
+    info_dict mentah hasil ekstraksi disimpan terpisah di memori saja, supaya
+    `video`/`audio` setelah `info` untuk link yang sama tidak mengekstrak ulang.
+    """
+    VERSION = 1
+    DEFAULT_TTL = 3600
+    DEFAULT_MAX_ENTRIES = 500
+    # URL stream di info_dict punya masa berlaku, jadi umurnya lebih pendek
+    INFO_TTL = 1800
+    MAX_INFOS = 32
+    # Tulis file paling sering tiap N detik (dan saat ditutup)
+    SAVE_INTERVAL = 5
+    YOUTUBE_ID = re.compile(
+        r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([\w-]{11})'
+    )
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.info_hits = 0
+        # key -> (expires_at, value), yang terlama di depan
+        self._entries = OrderedDict()
+        self._infos = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = 0.0
+        self._load()
+
+    @classmethod
+    def from_env(cls):
+        """YTDL_CACHE_TTL (detik, 0 = nonaktif), YTDL_CACHE_MAX_ENTRIES, YTDL_CACHE_FILE"""
+        ttl = os.environ.get('YTDL_CACHE_TTL')
+        max_entries = os.environ.get('YTDL_CACHE_MAX_ENTRIES')
+        return cls(
+            os.environ.get('YTDL_CACHE_FILE') or None,
+            int(ttl) if ttl else cls.DEFAULT_TTL,
+            int(max_entries) if max_entries else cls.DEFAULT_MAX_ENTRIES
+        )
+
+    @classmethod
+    def video_id(cls, url):
+        """ID video YouTube dari URL bentuk apa pun, atau None"""
+        match = cls.YOUTUBE_ID.search(url)
+        return match.group(1) if match else None
+
+    @classmethod
+    def url_key(cls, url):
+        video_id = cls.video_id(url)
+        return f"yt:{video_id}" if video_id else f"url:{url.strip()}"
+
+    @staticmethod
+    def search_key(query, max_results):
+        return f"search:{max_results}:{' '.join(query.split()).casefold()}"
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[key]
+                self._dirty = True
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+            due = time.time() - self._saved_at >= self.SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def get_info(self, url):
+        """Salinan info_dict mentah yang masih segar untuk URL ini, atau None"""
+        if self.ttl <= 0:
+            return None
+        key = self.url_key(url)
+        with self._lock:
+            entry = self._infos.get(key)
+            if entry is None or entry[0] <= time.time():
+                self._infos.pop(key, None)
+                return None
+            self._infos.move_to_end(key)
+            self.info_hits += 1
+            info = entry[1]
+        # process_ie_result mengubah dict yang diberikan
+        return copy.deepcopy(info)
+
+    def remember_info(self, info, *urls):
+        """Simpan info_dict (sudah di-sanitize) untuk `urls` dan webpage_url-nya"""
+        if self.ttl <= 0:
+            return
+        # Subtitle otomatis bisa ratusan KB dan tidak dipakai saat download
+        info.pop('automatic_captions', None)
+        keys = {self.url_key(u) for u in (*urls, info.get('webpage_url')) if u}
+        expires = time.time() + min(self.ttl, self.INFO_TTL)
+        with self._lock:
+            for key in keys:
+                self._infos[key] = (expires, info)
+                self._infos.move_to_end(key)
+            while len(self._infos) > self.MAX_INFOS:
+                self._infos.popitem(last=False)
+
+    def forget_info(self, url):
+        with self._lock:
+            self._infos.pop(self.url_key(url), None)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != self.VERSION:
+            return
+        now = time.time()
+        for key, expires, value in data.get('entries', []):
+            if expires > now:
+                self._entries[key] = (expires, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def save(self):
+        """Tulis cache ke file secara atomik (file sementara lalu rename)"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [[key, expires, value] for key, (expires, value) in self._entries.items()]
+            self._dirty = False
+            self._saved_at = time.time()
+
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.VERSION, 'entries': entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'info_hits': self.info_hits,
+                'infos': len(self._infos),
+                'ttl': self.ttl,
+            }
+
+INFO_CACHE = InfoCache.from_env()
+
+def resolve_info(ydl, url):
+    """
+    info_dict siap download untuk `url` (entri pertama kalau hasilnya pencarian):
+    dari INFO_CACHE kalau masih ada, kalau tidak diekstrak tanpa download.
+    Returns (info, reused).
+    """
+    info = INFO_CACHE.get_info(url)
+    if info is not None:
+        return info, True
+
+    info = ydl.extract_info(url, download=False)
+    if 'entries' in info: info = info['entries'][0]
+    info = ydl.sanitize_info(info, remove_private_keys=True)
+    INFO_CACHE.remember_info(copy.deepcopy(info), url)
+    return info, False
+
+def download_resolved(ydl, url, info, reused):
+    """
+    Pilih format + download dari info_dict yang sudah ada, tanpa ekstraksi ulang.
+    info_dict lama bisa gagal (URL stream kedaluwarsa): ekstrak ulang sekali.
+    """
+    try:
+        return ydl.process_ie_result(info, download=True)
+    except yt_dlp.utils.DownloadError:
+        if not reused:
+            raise
+    INFO_CACHE.forget_info(url)
+    info, _ = resolve_info(ydl, url)
+    return ydl.process_ie_result(info, download=True)
+
+class FileSlot:
+    """Satu item FILE_CACHE yang sedang dikunci; `entry` terisi kalau sudah ada di cache"""
+
+    def __init__(self, cache, key, entry):
+        self.cache = cache
+        self.key = key
+        self.entry = entry
+
+    def deliver(self, output_dir):
+        return self.cache.deliver(self.entry, output_dir)
+
+    def publish(self, result):
+        if self.key is not None:
+            self.cache.publish(self.key, result)
+
+class FileCache:
+    """
+    Cache file hasil akhir (mp3/mp4) per (ID video, varian) seperti bitrate
+    atau resolusi, di folder YTDL_FILE_CACHE_DIR dengan batas ukuran total
+    (LRU lewat mtime, jadi tetap berlaku setelah restart).
+    File diterbitkan secara atomik (nama sementara lalu rename). Setiap item
+    dikunci dengan flock selama diproses, jadi permintaan bersamaan untuk item
+    yang sama (juga dari proses lain) menunggu satu download yang sama.
+    Pemanggil mendapat hardlink/salinan di output_dir dan boleh menghapusnya.
+    """
+    VERSION = 1
+    DEFAULT_MAX_BYTES = 2048 * 1024 * 1024
+    # Jumlah file kunci tetap; item berbeda jarang berbagi kunci
+    LOCK_STRIPES = 256
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        # key -> ukuran file, yang terlama di depan
+        self._index = OrderedDict()
+        self._lock = threading.Lock()
+        if not directory:
+            return
+
+        os.makedirs(os.path.join(directory, 'locks'), exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith('.json'):
+                meta = self._read_meta(entry.name[:-5])
+                if meta is not None:
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.name[:-5], meta['size']))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self.total_bytes += size
+        self._evict()
+
+    @classmethod
+    def from_env(cls):
+        """YTDL_FILE_CACHE_DIR (kosong = nonaktif) dan YTDL_FILE_CACHE_MAX_MB"""
+        max_mb = os.environ.get('YTDL_FILE_CACHE_MAX_MB')
+        max_bytes = int(max_mb) * 1024 * 1024 if max_mb else cls.DEFAULT_MAX_BYTES
+        return cls(os.environ.get('YTDL_FILE_CACHE_DIR') or None, max_bytes)
+
+    @staticmethod
+    def key(video_id, variant):
+        return re.sub(r'[^\w.-]', '_', f"{video_id}.{variant}")
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_path(key), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != self.VERSION:
+            return None
+        return meta
+
+    @contextmanager
+    def slot(self, video_id, variant):
+        """Kunci item (video_id, variant) selama blok berjalan"""
+        if not self.directory:
+            yield FileSlot(self, None, None)
+            return
+
+        key = self.key(video_id, variant)
+        stripe = zlib.crc32(key.encode('utf-8')) % self.LOCK_STRIPES
+        with open(os.path.join(self.directory, 'locks', f"{stripe}.lock"), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield FileSlot(self, key, self._lookup(key))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _lookup(self, key):
+        meta = self._read_meta(key)
+        path = meta and os.path.join(self.directory, meta['file'])
+        if meta is None or not os.path.exists(path):
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+
+        os.utime(self._meta_path(key))
+        with self._lock:
+            if key not in self._index:
+                self._index[key] = meta['size']
+                self.total_bytes += meta['size']
+            self._index.move_to_end(key)
+            self.hits += 1
+        return meta
+
+    @staticmethod
+    def _link_or_copy(src, dest):
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+
+    def deliver(self, meta, output_dir):
+        """Hardlink (atau salinan) file cache ke output_dir dengan nama aslinya"""
+        os.makedirs(output_dir, exist_ok=True)
+        base, ext = os.path.splitext(meta['name'])
+        dest = os.path.join(output_dir, meta['name'])
+        n = 1
+        # Permintaan lain mungkin belum menghapus salinannya
+        while os.path.exists(dest):
+            n += 1
+            dest = os.path.join(output_dir, f"{base} ({n}){ext}")
+        self._link_or_copy(os.path.join(self.directory, meta['file']), dest)
+        return {**meta['result'], 'file_path': dest, 'cached': True}
+
+    def publish(self, key, result):
+        """Masukkan file `result['file_path']` ke cache beserta hasil JSON-nya"""
+        file_path = result.get('file_path')
+        if not file_path or not os.path.exists(file_path):
+            return
+        size = os.path.getsize(file_path)
+        if size > self.max_bytes:
+            return
+
+        name = key + os.path.splitext(file_path)[1]
+        meta = {
+            'version': self.VERSION,
+            'file': name,
+            'name': os.path.basename(file_path),
+            'size': size,
+            'result': {k: v for k, v in result.items() if k != 'file_path'},
+        }
+        tmp_prefix = os.path.join(self.directory, f".{key}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            self._link_or_copy(file_path, tmp_prefix + '.tmp')
+            os.replace(tmp_prefix + '.tmp', os.path.join(self.directory, name))
+            with open(tmp_prefix + '.json.tmp', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_prefix + '.json.tmp', self._meta_path(key))
+        except OSError:
+            for tmp in (tmp_prefix + '.tmp', tmp_prefix + '.json.tmp'):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+            return
+
+        with self._lock:
+            self._forget(key)
+            self._index[key] = size
+            self.total_bytes += size
+            self._evict()
+
+    def _forget(self, key):
+        size = self._index.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def _evict(self):
+        while self._index and self.total_bytes > self.max_bytes:
+            key, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            meta = self._read_meta(key)
+            paths = [self._meta_path(key)]
+            if meta is not None:
+                paths.append(os.path.join(self.directory, meta['file']))
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': bool(self.directory),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._index),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+FILE_CACHE = FileCache.from_env()
+
+def cached_download(url, variant, ydl_opts, output_dir, finish):
+    """
+    Download `url` lewat FILE_CACHE dengan kunci (ID video, `variant`).
+    Kalau belum ada: download, lalu `finish(info, base_path)` membuat hasil
+    JSON (dengan file_path) yang kemudian diterbitkan ke cache.
+    ID video diambil dari URL; untuk pencarian perlu ekstraksi dulu.
+    """
+    info = reused = None
+    video_id = InfoCache.video_id(url)
+    if video_id is None:
+        with SuppressOutput():
+            with YDL_POOL.acquire(ydl_opts) as ydl:
+                info, reused = resolve_info(ydl, url)
+        video_id = (
+            InfoCache.video_id(info.get('webpage_url') or '')
+            or f"{info.get('extractor_key', '')}-{info['id']}"
+        )
+
+    with FILE_CACHE.slot(video_id, variant) as slot:
+        if slot.entry is not None:
+            return slot.deliver(output_dir)
+
+        with SuppressOutput():
+            with YDL_POOL.acquire(ydl_opts) as ydl:
+                if info is None:
+                    info, reused = resolve_info(ydl, url)
+                info = download_resolved(ydl, url, info, reused)
+                base_path = ydl.prepare_filename(info)
+
+        result = finish(info, base_path)
+        slot.publish(result)
+        return {**result, 'cached': False}
+
 # --- SPOTIFY HELPER (IMPROVED) ---
 
 class SpotifyScraper:
@@ -142,12 +749,20 @@ class SpotifyScraper:
 
 def get_video_info(url):
     try:
-        ydl_opts = get_base_opts()
-        ydl_opts['writethumbnail'] = False 
-        
-        with SuppressOutput():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
+        key = InfoCache.url_key(url)
+        cached = INFO_CACHE.get(key)
+        if cached is not None:
+            return {**cached, 'videoUrl': url}
+
+        info = INFO_CACHE.get_info(url)
+        if info is None:
+            ydl_opts = get_base_opts()
+            ydl_opts['writethumbnail'] = False 
+            
+            with SuppressOutput():
+                with YDL_POOL.acquire(ydl_opts) as ydl:
+                    info = ydl.extract_info(url, download=False)
+                    INFO_CACHE.remember_info(ydl.sanitize_info(info, remove_private_keys=True), url)
         
         duration = info.get('duration', 0)
         resolutions = []
@@ -162,7 +777,7 @@ def get_video_info(url):
         
         unique_resolutions = list({v['resolution']: v for v in resolutions}.values())
         
-        return {
+        result = {
             'title': info.get('title', ''),
             'channel': info.get('uploader', ''),
             'duration': f"{duration // 60}:{duration % 60:02d}",
@@ -173,6 +788,8 @@ def get_video_info(url):
             'videoUrl': url,
             'resolutions': unique_resolutions
         }
+        INFO_CACHE.put(key, result)
+        return result
     except Exception as e:
         return {'error': str(e)}
 
@@ -204,42 +821,77 @@ def download_video(url, quality='720', output_dir='tmp'):
             'postprocessor_args': {'ffmpeg': ['-movflags', '+faststart']}
         })
         
-        with SuppressOutput():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                file_path = ydl.prepare_filename(info)
+        def finish(info, file_path):
+            if not os.path.exists(file_path):
+                base_name = os.path.splitext(file_path)[0]
+                if os.path.exists(base_name + '.mp4'): file_path = base_name + '.mp4'
 
-        if not os.path.exists(file_path):
-            base_name = os.path.splitext(file_path)[0]
-            if os.path.exists(base_name + '.mp4'): file_path = base_name + '.mp4'
+            return {
+                'title': info.get('title', ''),
+                'channel': info.get('uploader', ''),
+                'duration': info.get('duration', 0),
+                'thumbnail': info.get('thumbnail', ''),
+                'file_path': file_path,
+                'file_size': os.path.getsize(file_path) if os.path.exists(file_path) else 0,
+                'quality': f"{info.get('height', 'unknown')}p",
+                'format': 'mp4 (H.264)'
+            }
 
-        return {
-            'title': info.get('title', ''),
-            'channel': info.get('uploader', ''),
-            'duration': info.get('duration', 0),
-            'thumbnail': info.get('thumbnail', ''),
-            'file_path': file_path,
-            'file_size': os.path.getsize(file_path) if os.path.exists(file_path) else 0,
-            'quality': f"{info.get('height', 'unknown')}p",
-            'format': 'mp4 (H.264)'
-        }
+        return cached_download(url, f"v{resolution}", ydl_opts, output_dir, finish)
     except Exception as e:
         return {'error': str(e)}
 
-def download_audio(url, bitrate='128', output_dir='tmp', metadata_override=None):
+# Format audio yang bisa dikirim tanpa transcode kalau klien menerimanya:
+# stream pilihan, container sumber yang cukup di-remux/copy, dan mimetype
+AUDIO_OUTPUTS = {
+    'm4a': {'format': 'bestaudio[acodec^=mp4a]', 'sources': ('m4a', 'mp4'), 'mimetype': 'audio/mp4'},
+    'opus': {'format': 'bestaudio[acodec=opus]', 'sources': ('webm',), 'mimetype': 'audio/ogg; codecs=opus'},
+    'mp3': {'format': 'bestaudio[acodec=mp3]', 'sources': ('mp3',), 'mimetype': 'audio/mpeg'},
+}
+
+# Codec stream sumber -> ekstensi yang didapat tanpa transcode
+PASSTHROUGH_EXTS = {'mp4a': 'm4a', 'aac': 'm4a', 'opus': 'opus', 'mp3': 'mp3', 'vorbis': 'ogg'}
+
+def parse_accept(accept):
+    """'m4a,opus,mp3' -> ['m4a', 'opus', 'mp3'] (urutan = preferensi), default ['mp3']"""
+    if isinstance(accept, str):
+        accept = accept.split(',')
+    formats = [f.strip().lower() for f in accept or [] if f.strip().lower() in AUDIO_OUTPUTS]
+    # EmbedThumbnail untuk ogg/opus butuh mutagen
+    if not mutagen and 'opus' in formats:
+        formats.remove('opus')
+    return list(dict.fromkeys(formats)) or ['mp3']
+
+def audio_conversion(accept, bitrate):
+    """
+    (format, preferredcodec) untuk yt-dlp: utamakan stream yang codec-nya
+    diterima klien dan petakan container-nya ke format itu (remux/copy),
+    selain itu transcode ke mp3 (atau format pertama kalau mp3 tidak diterima).
+    """
+    if accept == ['mp3']:
+        return 'bestaudio/best', 'mp3'
+    selectors = [AUDIO_OUTPUTS[f]['format'] for f in accept]
+    mapping = [f"{source}>{f}" for f in accept for source in AUDIO_OUTPUTS[f]['sources']]
+    fallback = 'mp3' if 'mp3' in accept else accept[0]
+    return '/'.join([*selectors, 'bestaudio/best']), '/'.join([*mapping, fallback])
+
+def download_audio(url, bitrate='128', output_dir='tmp', metadata_override=None, accept='mp3'):
     try:
         valid_bitrates = ['32', '64', '96', '128', '192', '256', '320']
         if bitrate not in valid_bitrates: bitrate = '128'
+        # Injeksi metadata Spotify di bawah khusus untuk mp3
+        accept = ['mp3'] if metadata_override else parse_accept(accept)
+        format_str, preferredcodec = audio_conversion(accept, bitrate)
         
         os.makedirs(output_dir, exist_ok=True)
         ydl_opts = get_base_opts()
         
         ydl_opts.update({
-            'format': 'bestaudio/best',
+            'format': format_str,
             'outtmpl': os.path.join(output_dir, '%(title)s_audio.%(ext)s'),
             'noplaylist': True,
             'postprocessors': [
-                {'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': bitrate},
+                {'key': 'FFmpegExtractAudio', 'preferredcodec': preferredcodec, 'preferredquality': bitrate},
                 {'key': 'FFmpegMetadata', 'add_metadata': True},
                 {'key': 'EmbedThumbnail'}, 
             ],
@@ -250,77 +902,102 @@ def download_audio(url, bitrate='128', output_dir='tmp', metadata_override=None)
             safe_artist = "".join([c for c in metadata_override['artist'] if c.isalpha() or c.isdigit() or c==' ']).rstrip()
             ydl_opts['outtmpl'] = os.path.join(output_dir, f"{safe_artist} - {safe_title}.%(ext)s")
         
-        with SuppressOutput():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                real_url = url if url.startswith('http') else f"ytsearch1:{url}"
-                info = ydl.extract_info(real_url, download=True)
-                if 'entries' in info: info = info['entries'][0]
-                base_path = ydl.prepare_filename(info)
-                file_path = os.path.splitext(base_path)[0] + '.mp3'
-                
-        # --- MANUAL METADATA INJECTION (FFMPEG) UNTUK SPOTIFY ---
-        if metadata_override and os.path.exists(file_path):
-            temp_output = file_path.replace('.mp3', '_temp.mp3')
-            cover_path = os.path.join(output_dir, 'temp_cover.jpg')
-            has_cover = False
+        real_url = url if url.startswith('http') else f"ytsearch1:{url}"
+        variant = f"a{bitrate}"
+        if accept != ['mp3']:
+            variant += '-' + '+'.join(accept)
+        if metadata_override:
+            # Tag dan nama file ikut metadata Spotify
+            tags = json.dumps([metadata_override['title'], metadata_override['artist'], metadata_override.get('thumbnail')])
+            variant += '-' + hashlib.sha1(tags.encode('utf-8')).hexdigest()[:10]
+
+        def finish(info, base_path):
+            downloads = info.get('requested_downloads') or [{}]
+            file_path = downloads[-1].get('filepath') or os.path.splitext(base_path)[0] + '.mp3'
+            ext = os.path.splitext(file_path)[1][1:].lower()
+            source = (info.get('acodec') or '').split('.')[0]
+            transcoded = PASSTHROUGH_EXTS.get(source) != ext
+            convert_s = sum(seconds for name, seconds in timings if name == 'ExtractAudio')
+
+            # --- MANUAL METADATA INJECTION (FFMPEG) UNTUK SPOTIFY ---
+            if metadata_override and os.path.exists(file_path):
+                temp_output = file_path.replace('.mp3', '_temp.mp3')
+                # Per file, karena permintaan Spotify bisa jalan bersamaan
+                cover_path = os.path.splitext(file_path)[0] + '_cover.jpg'
+                has_cover = False
             
-            if metadata_override.get('thumbnail'):
-                try:
-                    urllib.request.urlretrieve(metadata_override['thumbnail'], cover_path)
-                    has_cover = True
-                except: pass
+                if metadata_override.get('thumbnail'):
+                    try:
+                        urllib.request.urlretrieve(metadata_override['thumbnail'], cover_path)
+                        has_cover = True
+                    except: pass
 
-            ffmpeg_cmd = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', file_path]
+                ffmpeg_cmd = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', file_path]
             
-            if has_cover:
-                ffmpeg_cmd.extend(['-i', cover_path, '-map', '0:a', '-map', '1:0', '-c:v', 'copy', '-id3v2_version', '3', '-metadata:s:v', 'title="Album cover"', '-metadata:s:v', 'comment="Cover (front)"'])
-            else:
-                ffmpeg_cmd.extend(['-map', '0:a'])
-
-            ffmpeg_cmd.extend([
-                '-c:a', 'copy',
-                '-metadata', f"title={metadata_override['title']}",
-                '-metadata', f"artist={metadata_override['artist']}",
-                '-metadata', f"album={metadata_override['title']} (Single)",
-                temp_output
-            ])
+                if has_cover:
+                    ffmpeg_cmd.extend(['-i', cover_path, '-map', '0:a', '-map', '1:0', '-c:v', 'copy', '-id3v2_version', '3', '-metadata:s:v', 'title="Album cover"', '-metadata:s:v', 'comment="Cover (front)"'])
+                else:
+                    ffmpeg_cmd.extend(['-map', '0:a'])
+
+                ffmpeg_cmd.extend([
+                    '-c:a', 'copy',
+                    '-metadata', f"title={metadata_override['title']}",
+                    '-metadata', f"artist={metadata_override['artist']}",
+                    '-metadata', f"album={metadata_override['title']} (Single)",
+                    temp_output
+                ])
             
-            import subprocess
-            subprocess.run(ffmpeg_cmd)
+                import subprocess
+                subprocess.run(ffmpeg_cmd)
             
-            if os.path.exists(temp_output):
-                os.remove(file_path)
-                os.rename(temp_output, file_path)
+                if os.path.exists(temp_output):
+                    os.remove(file_path)
+                    os.rename(temp_output, file_path)
             
-            if has_cover and os.path.exists(cover_path):
-                os.remove(cover_path)
+                if has_cover and os.path.exists(cover_path):
+                    os.remove(cover_path)
 
-            info['title'] = metadata_override['title']
-            info['uploader'] = metadata_override['artist']
-            info['thumbnail'] = metadata_override['thumbnail']
+                info['title'] = metadata_override['title']
+                info['uploader'] = metadata_override['artist']
+                info['thumbnail'] = metadata_override['thumbnail']
 
-        return {
-            'title': info.get('title', ''),
-            'channel': info.get('uploader', '') or info.get('channel', ''),
-            'duration': info.get('duration', 0),
-            'thumbnail': info.get('thumbnail', ''),
-            'file_path': file_path,
-            'file_size': os.path.getsize(file_path) if os.path.exists(file_path) else 0,
-            'bitrate': f"{bitrate}kbps",
-            'format': 'mp3',
-            'source': 'Spotify Match' if metadata_override else 'YouTube'
-        }
-            
+            return {
+                'title': info.get('title', ''),
+                'channel': info.get('uploader', '') or info.get('channel', ''),
+                'duration': info.get('duration', 0),
+                'thumbnail': info.get('thumbnail', ''),
+                'file_path': file_path,
+                'file_size': os.path.getsize(file_path) if os.path.exists(file_path) else 0,
+                'bitrate': f"{bitrate}kbps" if transcoded or not info.get('abr') else f"{round(info['abr'])}kbps",
+                'format': ext,
+                'mimetype': AUDIO_OUTPUTS.get(ext, {}).get('mimetype', 'application/octet-stream'),
+                'transcoded': transcoded,
+                # Waktu langkah ExtractAudio (transcode, atau remux/copy kalau transcoded false)
+                'transcode_ms': round(convert_s * 1000, 1),
+                'source': 'Spotify Match' if metadata_override else 'YouTube'
+            }
+
+        with STAGES.record() as timings:
+            result = cached_download(real_url, variant, ydl_opts, output_dir, finish)
+        if result.get('cached'):
+            # Dari cache: tidak ada transcode untuk permintaan ini
+            result.update({'transcoded': False, 'transcode_ms': 0})
+        return result
     except Exception as e:
         return {'error': str(e)}
 
 def search_youtube(query, max_results=10):
     try:
+        key = InfoCache.search_key(query, max_results)
+        cached = INFO_CACHE.get(key)
+        if cached is not None:
+            return cached
+
         ydl_opts = get_base_opts()
         ydl_opts.update({'extract_flat': True, 'writethumbnail': False})
         
         with SuppressOutput():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with YDL_POOL.acquire(ydl_opts) as ydl:
                 result = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
         
         videos = []
@@ -333,11 +1010,167 @@ def search_youtube(query, max_results=10):
                 'channel': entry.get('uploader', ''),
                 'views': entry.get('view_count', 0)
             })
+        INFO_CACHE.put(key, videos)
         return videos
     except Exception as e:
         return {'error': str(e)}
 
+def run_command(command, args):
+    """Satu perintah CLI/daemon -> hasil yang siap di-JSON-kan"""
+    if command == 'info' and args:
+        return get_video_info(args[0])
+
+    elif command == 'video' and args:
+        qual = args[1] if len(args) > 1 else '720'
+        out = args[2] if len(args) > 2 else './tmp'
+        return download_video(args[0], qual, out)
+
+    elif command == 'audio' and args:
+        bit = args[1] if len(args) > 1 else '128'
+        out = args[2] if len(args) > 2 else './tmp'
+        accept = args[3] if len(args) > 3 else 'mp3'
+        return download_audio(args[0], bit, out, accept=accept)
+
+    elif command == 'spotify' and args:
+        spotify_url = args[0]
+        bit = args[1] if len(args) > 1 else '128'
+        out = args[2] if len(args) > 2 else './tmp'
+
+        meta = SpotifyScraper.get_metadata(spotify_url)
+        result = download_audio(meta['query'], bit, out, metadata_override=meta)
+
+        result['metadata'] = {
+            'title': meta['title'],
+            'artist': meta['artist'],
+            'url': spotify_url
+        }
+        return result
+
+    elif command == 'search' and args:
+        limit = int(args[1]) if len(args) > 1 else 10
+        return search_youtube(args[0], limit)
+
+    elif command == 'stats':
+        return {'cache': INFO_CACHE.stats(), 'files': FILE_CACHE.stats()}
+
+    return {'error': 'Invalid command'}
+
+def batch_args(item, output_dir):
+    """Satu item batch -> argumen run_command, dengan default yang sama seperti CLI"""
+    kind = item.get('type', 'audio')
+    target = str(item.get('url') or item.get('query') or '')
+    output = str(item.get('output') or output_dir)
+    if kind == 'audio':
+        return kind, [target, str(item.get('bitrate', '128')), output, str(item.get('accept', 'mp3'))]
+    if kind == 'spotify':
+        return kind, [target, str(item.get('bitrate', '128')), output]
+    if kind == 'video':
+        return kind, [target, str(item.get('quality', '720')), output]
+    if kind == 'search':
+        return kind, [target, str(item.get('maxResults', 10))]
+    return kind, [target]
+
+def run_batch(spec, emit):
+    """
+    Jalankan `spec['items']` ({type, url/query, bitrate/quality, accept, output}) bersamaan:
+    paling banyak `network` item di tahap jaringan (default 3) dan `transcode`
+    item di FFmpeg (default batas global). `emit(index, result)` dipanggil
+    begitu satu item selesai; item yang gagal hanya menggagalkan dirinya sendiri.
+    Returns ringkasan.
+    """
+    items = spec.get('items') or []
+    output_dir = spec.get('output') or './tmp'
+    network_jobs = max(1, int(spec.get('network') or 3))
+    transcode_jobs = int(spec['transcode']) if spec.get('transcode') else None
+    network = threading.BoundedSemaphore(network_jobs)
+    transcode = threading.BoundedSemaphore(max(1, transcode_jobs)) if transcode_jobs else None
+    # Thread yang sedang transcode sudah melepas slot jaringannya
+    workers = network_jobs + (max(1, transcode_jobs) if transcode_jobs else os.cpu_count() or 1)
+    start = time.perf_counter()
+
+    def run(item):
+        with STAGES.limit(network, transcode):
+            command, args = batch_args(item, output_dir)
+            return run_command(command, args)
+
+    failed = 0
+    with ThreadPoolExecutor(min(workers, max(1, len(items)))) as pool:
+        futures = {pool.submit(run, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'error': str(e)}
+            if isinstance(result, dict) and 'error' in result:
+                failed += 1
+            emit(futures[future], result)
+
+    return {
+        'items': len(items),
+        'failed': failed,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+    }
+
+def serve():
+    """
+    Mode daemon: satu perintah JSON per baris di stdin, misalnya
+    {"id": 1, "command": "audio", "args": ["<url>", "128"]}
+    dijawab satu baris {"id": 1, "result": {...}} begitu selesai.
+    Perintah jalan paralel (YTDL_WORKERS, default 4), jadi urutan jawaban
+    bisa berbeda dari urutan permintaan; yt_dlp cukup di-import sekali dan
+    instance YoutubeDL tetap hangat di YDL_POOL.
+    `batch` ({"id", "command": "batch", "items": [...], "network", "transcode"})
+    dijawab satu baris {"id", "index", "result"} per item begitu selesai,
+    lalu {"id", "done": true, "result": ringkasan}.
+    """
+    sys.stdin.reconfigure(encoding='utf-8')
+    # SuppressOutput menukar sys.stdout, jadi simpan stream aslinya
+    stdout = sys.stdout
+    write_lock = threading.Lock()
+    workers = max(1, int(os.environ.get('YTDL_WORKERS') or 4))
+
+    def reply(request_id, result, **extra):
+        line = json.dumps({'id': request_id, **extra, 'result': result}, ensure_ascii=False)
+        with write_lock:
+            stdout.write(line + '\n')
+            stdout.flush()
+
+    def answer(request):
+        request_id = request.get('id')
+        batch = request.get('command') == 'batch'
+        try:
+            if batch:
+                result = run_batch(request, lambda index, item: reply(request_id, item, index=index))
+            else:
+                args = [str(arg) for arg in request.get('args', [])]
+                result = run_command(request.get('command'), args)
+        except Exception as e:
+            result = {'error': str(e)}
+
+        if batch:
+            reply(request_id, result, done=True)
+        else:
+            reply(request_id, result)
+
+    with ThreadPoolExecutor(workers) as pool:
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                reply(None, {'error': f'Invalid request: {e}'})
+                continue
+            pool.submit(answer, request)
+
+    YDL_POOL.close()
+    INFO_CACHE.save()
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve()
+        sys.exit(0)
+
     if len(sys.argv) < 2:
         print(json.dumps({'error': 'No command provided'}))
         sys.exit(1)
@@ -345,44 +1178,20 @@ if __name__ == '__main__':
     command = sys.argv[1]
     
     try:
-        if command == 'info' and len(sys.argv) > 2:
-            print(json.dumps(get_video_info(sys.argv[2]), ensure_ascii=False, indent=2))
-            
-        elif command == 'video' and len(sys.argv) > 2:
-            url = sys.argv[2]
-            qual = sys.argv[3] if len(sys.argv) > 3 else '720'
-            out = sys.argv[4] if len(sys.argv) > 4 else './tmp'
-            print(json.dumps(download_video(url, qual, out), ensure_ascii=False, indent=2))
-            
-        elif command == 'audio' and len(sys.argv) > 2:
-            url = sys.argv[2]
-            bit = sys.argv[3] if len(sys.argv) > 3 else '128'
-            out = sys.argv[4] if len(sys.argv) > 4 else './tmp'
-            print(json.dumps(download_audio(url, bit, out), ensure_ascii=False, indent=2))
-        
-        elif command == 'spotify' and len(sys.argv) > 2:
-            spotify_url = sys.argv[2]
-            bit = sys.argv[3] if len(sys.argv) > 3 else '128'
-            out = sys.argv[4] if len(sys.argv) > 4 else './tmp'
-            
-            meta = SpotifyScraper.get_metadata(spotify_url)
-            result = download_audio(meta['query'], bit, out, metadata_override=meta)
-            
-            result['metadata'] = {
-                'title': meta['title'],
-                'artist': meta['artist'],
-                'url': spotify_url
-            }
-            print(json.dumps(result, ensure_ascii=False, indent=2))
-
-        elif command == 'search' and len(sys.argv) > 2:
-            q = sys.argv[2]
-            limit = int(sys.argv[3]) if len(sys.argv) > 3 else 10
-            print(json.dumps(search_youtube(q, limit), ensure_ascii=False, indent=2))
-            
-        else:
-            print(json.dumps({'error': 'Invalid command'}, ensure_ascii=False))
-            
+        if command == 'batch' and len(sys.argv) > 2:
+            # Satu baris JSON per item begitu selesai, lalu ringkasan.
+            # Thread lain bisa sedang di SuppressOutput, jadi tulis ke stream aslinya
+            stdout = sys.stdout
+            def emit(index, result):
+                stdout.write(json.dumps({'index': index, 'result': result}, ensure_ascii=False) + '\n')
+                stdout.flush()
+            summary = run_batch(json.loads(sys.argv[2]), emit)
+            print(json.dumps({'done': True, 'result': summary}, ensure_ascii=False))
+            sys.exit(0)
+        print(json.dumps(run_command(command, sys.argv[2:]), ensure_ascii=False, indent=2))
     except Exception as e:
         print(json.dumps({'error': str(e)}, ensure_ascii=False))
         sys.exit(1)
+    finally:
+        YDL_POOL.close()
+        INFO_CACHE.save()
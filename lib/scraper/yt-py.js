@@ -1,73 +1,145 @@
 import { join } from 'path';
 
 const __dirname = import.meta.dir;
+const pythonScript = join(__dirname, '../python/yt-dl.py');
 
-function runPython(args = [], { timeoutMs = 180000 } = {}) {
-  return new Promise(async (resolve, reject) => {
-    const pythonScript = join(__dirname, '../python/yt-dl.py');
-    let proc;
-    let timeoutTimer;
+/**
+ * One warm `yt-dl.py --serve` process shared by every command.
+ * Requests and responses are newline-delimited JSON matched through `id`;
+ * the daemon runs commands concurrently, so answers can arrive out of order.
+ * A batch answers with one `index` line per finished item, then a `done` line.
+ */
+class YtDaemon {
+  constructor() {
+    this.proc = null;
+    this.pending = new Map();
+    this.nextId = 1;
+    this.buffer = '';
+  }
 
+  start() {
+    const proc = Bun.spawn(['python3', pythonScript, '--serve'], {
+      stdin: 'pipe',
+      stdout: 'pipe',
+      stderr: 'inherit',
+    });
+    this.proc = proc;
+    this.buffer = '';
+    this.readLoop(proc);
+    proc.exited.then((code) => {
+      if (this.proc === proc) this.proc = null;
+      this.failAll(new Error(`Python exited ${code}`));
+    });
+  }
+
+  async readLoop(proc) {
+    const decoder = new TextDecoder();
+    try {
+      for await (const chunk of proc.stdout) {
+        this.buffer += decoder.decode(chunk, { stream: true });
+        let newline;
+        while ((newline = this.buffer.indexOf('\n')) !== -1) {
+          const line = this.buffer.slice(0, newline);
+          this.buffer = this.buffer.slice(newline + 1);
+          if (line.trim()) this.handle(line);
+        }
+      }
+    } catch {}
+  }
+
+  handle(line) {
+    let response;
     try {
-      proc = Bun.spawn(['python3', pythonScript, ...args], {
-        stdin: 'ignore',
-        stdout: 'pipe',
-        stderr: 'pipe',
-      });
+      response = JSON.parse(line);
     } catch (e) {
-      return reject(new Error(`Failed to spawn Python process: ${e.message}`));
+      this.failAll(new Error(`Failed to parse JSON: ${e.message}`));
+      return;
     }
 
-    const timeoutPromise = new Promise((_, rej) => {
-      timeoutTimer = setTimeout(() => {
-        if (proc && !proc.killed) {
-          proc.kill();
-          rej(new Error(`Python timed out after ${timeoutMs}ms`));
-        }
-      }, timeoutMs);
-    });
+    const entry = this.pending.get(response.id);
+    if (!entry) return;
 
-    const executionPromise = (async () => {
-      const stdoutPromise = new Response(proc.stdout).text();
-      const stderrPromise = new Response(proc.stderr).text();
+    if (response.index !== undefined && !response.done) {
+      clearTimeout(entry.timer);
+      entry.timer = entry.arm();
+      entry.onItem?.(response.index, response.result);
+      return;
+    }
+    this.pending.delete(response.id);
+    clearTimeout(entry.timer);
 
-      const exitCode = await proc.exited;
-      
-      clearTimeout(timeoutTimer);
+    const result = response.result;
+    if (result?.error) entry.reject(new Error(result.error));
+    else entry.resolve(result ?? {});
+  }
 
-      const output = await stdoutPromise;
-      const errorOutput = await stderrPromise;
+  failAll(error) {
+    for (const entry of this.pending.values()) {
+      clearTimeout(entry.timer);
+      entry.reject(error);
+    }
+    this.pending.clear();
+  }
 
-      if (exitCode !== 0) {
-        throw new Error(`Python exited ${exitCode}: ${errorOutput || '(no stderr)'}`);
-      }
+  request(message, timeoutMs, onItem) {
+    if (!this.proc) this.start();
 
-      try {
-        if (!output.trim()) return {};
-        
-        const result = JSON.parse(output);
-        if (result?.error) throw new Error(result.error);
-        return result;
-      } catch (e) {
-        throw new Error(`Failed to parse JSON: ${e.message}`);
-      }
-    })();
+    const id = this.nextId++;
+    const line = JSON.stringify({ ...message, id }) + '\n';
 
-    try {
-      const result = await Promise.race([executionPromise, timeoutPromise]);
-      resolve(result);
-    } catch (err) {
-      if (proc && !proc.killed) proc.kill();
-      clearTimeout(timeoutTimer);
-      reject(err);
-    }
+    return new Promise((resolve, reject) => {
+      // Other commands keep running in the daemon, so only this request is dropped.
+      // Batches re-arm the timeout on every finished item
+      const arm = () => setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error(`Python timed out after ${timeoutMs}ms`));
+      }, timeoutMs);
+
+      this.pending.set(id, { resolve, reject, timer: arm(), arm, onItem });
+      this.proc.stdin.write(line);
+      this.proc.stdin.flush();
+    });
+  }
+}
+
+const daemon = new YtDaemon();
+
+function runPython([command, ...args] = [], { timeoutMs = 180000 } = {}) {
+  return daemon.request({ command, args: args.filter((arg) => arg !== undefined).map(String) }, timeoutMs);
+}
+
+/**
+ * Download several items in one request.
+ * @param {{type?: 'audio'|'video'|'spotify'|'info'|'search', url?: string, query?: string,
+ *   bitrate?: string, quality?: string, accept?: string, output?: string}[]} items
+ * @param {{network?: number, transcode?: number, output?: string, timeoutMs?: number}} options
+ *   `network` items download at once (default 3), `transcode` run FFmpeg at once
+ * @param {(item: {index: number, result?: object, error?: string}) => void} [onItem] fires as each item finishes
+ * @returns {Promise<{index: number, result?: object, error?: string}[]>} in input order
+ */
+async function ytBatch(items, options = {}, onItem) {
+  const { network, transcode, output, timeoutMs = 180000 } = options;
+  const results = new Array(items.length);
+
+  await daemon.request({ command: 'batch', items, network, transcode, output }, timeoutMs, (index, result) => {
+    const item = result?.error ? { index, error: result.error } : { index, result };
+    results[index] = item;
+    onItem?.(item);
   });
+
+  return results;
 }
 
 async function getInfo(url) { return runPython(['info', url]); }
 async function ytVideo(url, quality = '720') { return runPython(['video', url, quality]); }
-async function ytAudio(url, q = '128', p) { return runPython(['audio', url, q, p]); }
+/**
+ * @param {string} [accept] formats the client plays, in preference order (e.g. 'm4a,opus,mp3');
+ *   a matching stream is remuxed instead of transcoded. Default 'mp3'
+ * @returns result with `format`, `mimetype`, `transcoded` and `transcode_ms`
+ */
+async function ytAudio(url, q = '128', p, accept) { return runPython(['audio', url, q, p ?? './tmp', accept]); }
 async function ytSearch(query, maxResults = 10) { return runPython(['search', query, String(maxResults)]); }
 async function spotifyDownload(url, quality = '256') { return runPython(['spotify', url, quality]); }
+async function ytStats() { return runPython(['stats']); }
 
-export { getInfo, ytVideo, ytAudio, ytSearch, spotifyDownload };
+export { getInfo, ytVideo, ytAudio, ytSearch, spotifyDownload, ytStats, ytBatch };
@@ -24,7 +24,7 @@ const handler = async (m, { conn, text, usedPrefix, command, args, Func, loading
                     q = args[2];
                 }
 
-                const info = await ytAudio(url, q, TMP_DIR);
+                const info = await ytAudio(url, q, TMP_DIR, 'm4a,mp3');
                 const filePath = info?.file_path;
                 
                 if (!filePath) throw new Error(`Gagal mendapatkan file audio (${q}kbps).`);
@@ -38,8 +38,8 @@ const handler = async (m, { conn, text, usedPrefix, command, args, Func, loading
 
                 await conn.sendMessage(m.chat, {
                     document: { url: filePath },
-                    mimetype: 'audio/mpeg',
-                    fileName: `${info.title}.mp3`,
+                    mimetype: info.mimetype || 'audio/mpeg',
+                    fileName: `${info.title}.${info.format || 'mp3'}`,
                     ...(thumb ? { jpegThumbnail: thumb } : {}),
                 }, { quoted: m });
 
@@ -1,4 +1,4 @@
-import sharp from "sharp"
+import { toImage } from "#addon/sticker.js"
 
 let handler = async (m, { conn, usedPrefix, command, loading }) => {
   const q = m.quoted ? m.quoted : m
@@ -10,7 +10,7 @@ let handler = async (m, { conn, usedPrefix, command, loading }) => {
     const buffer = await q.download?.()
     if (!buffer || !Buffer.isBuffer(buffer)) throw new Error("Failed to download sticker buffer.")
 
-    const output = await sharp(buffer).png().toBuffer()
+    const output = await toImage(buffer, { format: "png" })
     if (!output.length) throw new Error("Conversion failed, output is empty.")
 
     await conn.sendMessage(
@@ -207,7 +207,7 @@ export async function clientBot(conn) {
       let opts = {
         crop: options.crop !== undefined ? options.crop : false,
         quality: options.quality || 90,
-        fps: options.fps || 15,
+        fps: options.fps,
         maxDuration: options.maxDuration || 15,
         packName: options.pack || global.config.packnames || "",
         authorName: options.author || global.config.authors || "",